@@ -32,6 +32,21 @@ import subprocess
 import datetime
 import time
 import ssl
+import re
+import hashlib
+import zlib
+import itertools
+import resource
+import gzip
+import io
+import heapq
+import threading
+import socket
+import xml.etree.ElementTree as ElementTree
+try :
+    import queue
+except ImportError :
+    import Queue as queue
 import requests,json
 requests.packages.urllib3.disable_warnings()
 
@@ -40,10 +55,690 @@ import logging
 __author__ = "MapR"
  
 
+    # Split a version string ("5.1.0", "0.9.0", "1.4.1-mapr") into
+    # a tuple that compares semantically ('10.0.0' > '5.1.0').
+    # Trailing zero components are dropped so "1.2" == "1.2.0".
+def versionKey(version) :
+    key = []
+    for part in re.split('[.-]', str(version)) :
+        m = re.match('([0-9]*)(.*)', part)
+        if m.group(1) == '' :
+            key.append ( (-1, m.group(2)) )
+        else :
+            key.append ( (int(m.group(1)), m.group(2)) )
+    while len(key) > 0  and  key[-1] == (0, '') :
+        key.pop()
+    return tuple(key)
+
+def versionCompare(v1, v2) :
+    k1 = versionKey(v1)
+    k2 = versionKey(v2)
+    return (k1 > k2) - (k1 < k2)
+
+
+    # Azure VM shapes shipped with the templates (Standard_<size>.json).
+    # data_disks is the number of data disks the template attaches;
+    # premium sizes use Premium_LRS storage (fewer, faster disks).
+VM_PROFILES = {
+    'Standard_D3'   : { 'cores' : 4,  'memory_gb' : 14,  'data_disks' : 8,  'premium' : False },
+    'Standard_D4'   : { 'cores' : 8,  'memory_gb' : 28,  'data_disks' : 16, 'premium' : False },
+    'Standard_D12'  : { 'cores' : 4,  'memory_gb' : 28,  'data_disks' : 8,  'premium' : False },
+    'Standard_D13'  : { 'cores' : 8,  'memory_gb' : 56,  'data_disks' : 16, 'premium' : False },
+    'Standard_D14'  : { 'cores' : 16, 'memory_gb' : 112, 'data_disks' : 32, 'premium' : False },
+    'Standard_DS3'  : { 'cores' : 4,  'memory_gb' : 14,  'data_disks' : 4,  'premium' : True },
+    'Standard_DS4'  : { 'cores' : 8,  'memory_gb' : 28,  'data_disks' : 4,  'premium' : True },
+    'Standard_DS12' : { 'cores' : 4,  'memory_gb' : 28,  'data_disks' : 4,  'premium' : True },
+    'Standard_DS13' : { 'cores' : 8,  'memory_gb' : 56,  'data_disks' : 4,  'premium' : True },
+    'Standard_DS14' : { 'cores' : 16, 'memory_gb' : 112, 'data_disks' : 4,  'premium' : True }
+}
+
+    # VM size of this node from the Azure instance metadata service
+    # (the cluster nodes share one size), or None off Azure
+AZURE_METADATA_URL = "http://169.254.169.254/metadata/instance/compute/vmSize"
+
+def azureVmSize(timeout=2) :
+    try :
+        r = requests.get (AZURE_METADATA_URL, headers = { 'Metadata' : 'true' },
+            params = { 'api-version' : '2017-08-01', 'format' : 'text' }, timeout = timeout)
+    except requests.RequestException :
+        return None
+    if r.status_code != requests.codes.ok  or  len(r.text.strip()) == 0 :
+        return None
+    return r.text.strip()
+
+    # Share of node memory (percent, with a floor in MB) given to
+    # each memory-hungry service.  NodeManager gets what is left
+    # after the OS reserve and the services present on the cluster.
+SERVICE_MEMORY_SHARES = {
+    'mapr-fileserver'       : ( 20, 2048 ),
+    'mapr-cldb'             : ( 8,  1024 ),
+    'mapr-zookeeper'        : ( 2,  512 ),
+    'mapr-resourcemanager'  : ( 4,  1024 ),
+    'mapr-hbase'            : ( 8,  1024 ),
+    'mapr-drill'            : ( 15, 2048 )
+}
+OS_MEMORY_SHARE = ( 10, 2048 )
+
+
+    # Cluster configuration snapshots (see MIDriver.exportSnapshot).
+    # Host names are stored as MAPRNODE<n> tokens (the index into the
+    # cluster host list, as in /tmp/maprhosts) so a snapshot can be
+    # applied to a different set of hosts.  Credentials and the
+    # license are never written to a snapshot.
+SNAPSHOT_VERSION = 1
+SNAPSHOT_NODE_PREFIX = "MAPRNODE"
+SNAPSHOT_EXCLUDED_CONFIG = [ 'hosts', 'services', 'license', 'cluster_admin_password', 
+    'ssh_id', 'ssh_key', 'ssh_password', 'mapr_name', 'mapr_password',
+    'repo_core_url', 'repo_eco_url' ]
+
+
+    # Typed views of installer responses.  Each body is parsed
+    # once (see MIDriver.poll_get and the get_* accessors) into 
+    # these slotted objects rather than kept as dicts, and host
+    # ids are interned so the same name is stored only once no
+    # matter how many hosts, groups and services refer to it.
+def internId(hostId) :
+    if hostId == None :
+        return None
+    try :
+        return sys.intern (hostId)
+    except AttributeError :
+        return intern (str(hostId))
+
+class MIProcess:
+    __slots__ = ( 'state', 'status' )
+    def __init__(self, body) :
+        self.state = body.get('state')
+        self.status = body.get('status')
+
+class MIHost:
+    __slots__ = ( 'id', 'state', 'status', 'version' )
+    def __init__(self, body) :
+        self.id = internId (body.get('id'))
+        self.state = body.get('state')
+        self.status = body.get('status')
+        self.version = body.get('version')
+
+class MIGroup:
+    __slots__ = ( 'id', 'label', 'hosts' )
+    def __init__(self, body) :
+        self.id = body.get('id')
+        self.label = body.get('label')
+        self.hosts = [ internId(h) for h in body.get('hosts', []) ]
+
+class MIServiceEntry:
+    __slots__ = ( 'name', 'version', 'hosts', 'ui_ports' )
+    def __init__(self, body) :
+        self.name = body.get('name')
+        self.version = body.get('version')
+        self.hosts = [ internId(h) for h in body.get('hosts', []) ]
+        self.ui_ports = body.get('ui_ports', [])
+
+def hostList(body) :
+    return [ MIHost(h) for h in body.get('resources', []) ]
+
+
+    # Run func(item) for every item, with at most limit calls
+    # running at once.  Returns a dict mapping each item to
+    # func's result (or to the exception it raised).
+def runParallel(func, items, limit) :
+    results = {}
+    pending = list(items)
+    lock = threading.Lock()
+
+    def worker() :
+        while True :
+            with lock :
+                if len(pending) == 0 :
+                    return
+                item = pending.pop(0)
+            try :
+                res = func(item)
+            except Exception as e :
+                res = e
+            with lock :
+                results[item] = res
+
+    workers = [ threading.Thread(target=worker) for i in range(max(1, min(limit, len(pending)))) ]
+    for w in workers :
+        w.daemon = True
+        w.start()
+    for w in workers :
+        w.join()
+    return results
+
+
+    # In-memory index of the installer's service catalog
+    # (/api/services), keyed by package name.  Built once so that
+    # availability checks and "latest" lookups don't cost a REST
+    # query each.
+    #
+    # Catalog entries that carry "min_core_version" or
+    # "max_core_version" are only offered for core versions in 
+    # that range; entries without them are assumed compatible
+    # with every core version the installer supports.
+class MIVersionIndex:
+    def __init__(self, resources=[]) :
+        self.packages = {}
+        for entry in resources :
+            name = entry.get('name')
+            version = entry.get('version')
+            if name == None  or  version == None :
+                continue
+            self.packages.setdefault(name, []).append (entry)
+
+        for name in self.packages :
+            self.packages[name].sort (key=lambda e: versionKey(e['version']))
+
+    def versions(self, name) :
+        return [ e['version'] for e in self.packages.get(name, []) ]
+
+        # The catalog's own spelling of version ("1.10" may be 
+        # listed as "1.10.0"), or None if the catalog lacks it.
+        # The installer only accepts versions as it lists them.
+    def canonical(self, name, version) :
+        vkey = versionKey(version)
+        for e in self.packages.get(name, []) :
+            if versionKey(e['version']) == vkey :
+                return e['version']
+        return None
+
+    def available(self, name, version) :
+        return ( self.canonical (name, version) != None )
+
+        # Highest version of name usable with core_version
+        # (or simply the highest if core_version is None)
+    def latest(self, name, core_version=None) :
+        for e in reversed(self.packages.get(name, [])) :
+            if core_version != None :
+                if 'min_core_version' in e  and  versionCompare(core_version, e['min_core_version']) < 0 :
+                    continue
+                if 'max_core_version' in e  and  versionCompare(core_version, e['max_core_version']) > 0 :
+                    continue
+            return e['version']
+        return None
+
+
+    # Package repositories (yum layout, as on package.mapr.com).
+    # Core packages live under v<mapr_version>/<os>, ecosystem 
+    # packages under ecosystem-<major>.x/<os>.  Services whose 
+    # package name differs from the service name are mapped here
+    # (None for services that come from the OS repositories).
+PACKAGE_UPSTREAM_URL = "http://package.mapr.com/releases"
+MAPR_CORE_SERVICES = [ 'mapr-core', 'mapr-cldb', 'mapr-fileserver', 'mapr-webserver', 'mapr-zookeeper',
+    'mapr-nodemanager', 'mapr-resourcemanager', 'mapr-historyserver', 'mapr-nfs' ]
+SERVICE_PACKAGES = { 'mapr-hive-client' : 'mapr-hive', 'mapr-spark-client' : 'mapr-spark', 'mapr-mysql' : None }
+
+REPO_NS = { 'repo' : 'http://linux.duke.edu/metadata/repo',
+    'common' : 'http://linux.duke.edu/metadata/common',
+    'rpm' : 'http://linux.duke.edu/metadata/rpm' }
+
+    # Does an rpm version ("1.2.201601281422") belong to a service
+    # version ("1.2") ?  Only as many components as the service
+    # version has are compared, so "5.0.0" does not match "5.1.0".
+def packageVersionMatch(rpmVersion, version) :
+    nparts = len (re.split('[.-]', str(version)))
+    return versionKey ('.'.join (re.split('[.-]', rpmVersion)[:nparts])) == versionKey(version)
+
+
+    # Package index of one yum repository, read from its 
+    # repodata (repomd.xml and the primary metadata it points to).
+    # For each package we keep the versions present, the file 
+    # location and the names it requires, so that a package can be
+    # checked together with its dependencies (from this repo or 
+    # the others given to closure).
+class MIPackageRepo:
+    def __init__(self, url, timeout=60) :
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.packages = {}
+        self.provides = {}
+        self.loaded = False
+
+        # Returns False if the repository metadata can't be read
+    def load(self) :
+        try :
+            r = requests.get (self.url + "/repodata/repomd.xml", timeout=self.timeout)
+            if r.status_code != requests.codes.ok :
+                return (False)
+            primary = None
+            for data in ElementTree.fromstring(r.content).findall('repo:data', REPO_NS) :
+                if data.get('type') == 'primary' :
+                    primary = data.find('repo:location', REPO_NS).get('href')
+            if primary == None :
+                return (False)
+
+            r = requests.get (self.url + "/" + primary, timeout=self.timeout)
+            if r.status_code != requests.codes.ok :
+                return (False)
+            content = r.content
+            if primary.endswith ('.gz') :
+                content = gzip.GzipFile (fileobj=io.BytesIO(content)).read()
+            root = ElementTree.fromstring (content)
+        except (requests.RequestException, ElementTree.ParseError, IOError) :
+            return (False)
+
+        for pkg in root.findall('common:package', REPO_NS) :
+            name = pkg.findtext('common:name', None, REPO_NS)
+            entry = { 'version' : pkg.find('common:version', REPO_NS).get('ver'),
+                'href' : pkg.find('common:location', REPO_NS).get('href'),
+                'requires' : [ e.get('name') for e in pkg.findall('common:format/rpm:requires/rpm:entry', REPO_NS) ] }
+            self.packages.setdefault(name, []).append (entry)
+            for e in pkg.findall('common:format/rpm:provides/rpm:entry', REPO_NS) :
+                self.provides[e.get('name')] = name
+        self.loaded = True
+        return (True)
+
+    def find(self, name, version=None) :
+        matches = [ e for e in self.packages.get(name, []) 
+            if version == None  or  packageVersionMatch (e['version'], version) ]
+        if len(matches) == 0 :
+            return None
+        return max (matches, key=lambda e: versionKey(e['version']))
+
+        # name/version plus everything it requires that this repo
+        # or one of others provides, as a dict of package name to
+        # (repo, entry); (None, None) for packages no repo has.
+        # Ecosystem packages, for instance, require mapr-client or
+        # mapr-core from the core repo.  Requirements nothing 
+        # provides are assumed to come from the OS repositories,
+        # unless they are MapR ("mapr-*") packages.
+    def closure(self, name, version=None, others=[]) :
+        repos = [ self ] + list(others)
+        found = {}
+        pending = [ (name, version) ]
+        while len(pending) > 0 :
+            (pname, pversion) = pending.pop()
+            if pname in found :
+                continue
+            found[pname] = (None, None)
+            for repo in repos :
+                entry = repo.find (pname, pversion)
+                if entry != None :
+                    found[pname] = (repo, entry)
+                    break
+            entry = found[pname][1]
+            if entry == None :
+                continue
+            for req in entry['requires'] :
+                dep = None
+                for repo in repos :
+                    dep = repo.provides.get(req)
+                    if dep != None :
+                        break
+                if dep == None  and  req.startswith ('mapr-') :
+                    dep = req
+                if dep != None  and  dep not in found :
+                    pending.append ( (dep, None) )
+        return found
+
+
+    # On-disk cache of trial licenses from the stage server, keyed
+    # by edition and stage user.  Each retry of installer-wrapper.sh
+    # (and each cluster deployed from the same system) can then 
+    # reuse a license rather than download it again.
+    #
+    # A cached license is used while its expiry (parsed from the 
+    # license text) is more than "margin" seconds away, or, if no
+    # expiry can be found, for max_age seconds after it was saved.
+    # Licenses older than refresh_age are refreshed in a background
+    # thread while the cached copy is used.  In offline mode the
+    # stage server is never contacted; the cache directory is 
+    # expected to be pre-seeded (files may also be named as on the
+    # server, LatestDemoLicense-<edition>.txt).
+LICENSE_CACHE_DIR = "/var/tmp/mapr-licenses"
+LICENSE_EXPIRY_PATTERNS = [ 
+    ( re.compile (r'(?i)expir\w*(?:\s+date)?\W{0,8}(\d{4}-\d\d-\d\d)'), 'date' ),
+    ( re.compile (r'(?i)expir\w*(?:\s+date)?\W{0,8}(\d{10,13})\b'), 'epoch' ) ]
+
+def licenseExpiry(text) :
+    for (pattern, kind) in LICENSE_EXPIRY_PATTERNS :
+        m = pattern.search (text)
+        if m == None :
+            continue
+        if kind == 'date' :
+            expires = datetime.datetime.strptime (m.group(1), "%Y-%m-%d")
+            return (expires - datetime.datetime(1970, 1, 1)).total_seconds()
+        stamp = int (m.group(1))
+        if stamp > 10000000000 :
+            stamp = stamp / 1000            # milliseconds
+        return float (stamp)
+    return None
+
+class MILicenseCache:
+    def __init__(self, cacheDir=LICENSE_CACHE_DIR, offline=False, timeout=30) :
+        self.cache_dir = cacheDir
+        self.offline = offline
+        self.timeout = timeout
+        self.margin = 86400
+        self.max_age = 7 * 86400
+        self.refresh_age = 86400
+        self.logger = logging.getLogger()
+
+    def fileNames(self, edition, user) :
+        names = []
+        if user != None :
+            names.append ("%s-%s.txt" % (edition, hashlib.sha1(user.encode('utf-8')).hexdigest()[:12]))
+        names.append ("LatestDemoLicense-%s.txt" % edition)
+        return [ os.path.join (self.cache_dir, n) for n in names ]
+
+        # (text, age) of the first usable cached license, or None
+    def lookup(self, edition, user) :
+        now = time.time()
+        for fname in self.fileNames (edition, user) :
+            if not os.path.isfile (fname) :
+                continue
+            with open (fname, "r") as lf :
+                text = lf.read()
+            age = now - os.path.getmtime (fname)
+            expires = licenseExpiry (text)
+            if expires != None :
+                if expires - now > self.margin :
+                    return (text, age)
+                self.logger.info ("Cached license %s expired or expiring", fname)
+            elif age < self.max_age :
+                return (text, age)
+        return None
+
+    def store(self, edition, user, text) :
+        try :
+            if not os.path.isdir (self.cache_dir) :
+                os.makedirs (self.cache_dir, 0o700)
+            fname = self.fileNames (edition, user)[0]
+            with open (fname + ".tmp", "w") as lf :
+                lf.write (text)
+            os.rename (fname + ".tmp", fname)
+        except (OSError, IOError) as e :
+            self.logger.warn ("Cannot cache license in %s: %s", self.cache_dir, e)
+
+        # Download from url; returns the license text or None
+    def fetch(self, url, edition, user, password, timeout=None) :
+        if timeout == None :
+            timeout = self.timeout
+        try :
+            r = requests.get (url, auth = (user, password),
+                headers = { 'Content-Type' : 'text/plain' },
+                timeout = timeout)
+        except requests.RequestException as e :
+            self.logger.warn ("License download from %s failed: %s", url, e)
+            return None
+        if r.status_code != requests.codes.ok :
+            self.logger.warn ("License download from %s returned bad status %d", url, r.status_code)
+            return None
+        self.store (edition, user, r.text)
+        return r.text
+
+    def get(self, url, edition, user, password, timeout=None) :
+        cached = self.lookup (edition, user)
+        if cached != None :
+            (text, age) = cached
+            if self.offline == False  and  age > self.refresh_age :
+                refresher = threading.Thread (target=self.fetch, args=(url, edition, user, password))
+                refresher.daemon = True
+                refresher.start()
+            return text
+        if self.offline == True :
+            self.logger.warn ("No cached %s license in %s (offline mode)", edition, self.cache_dir)
+            return None
+        return self.fetch (url, edition, user, password, timeout)
+
+
+    # Raised when a deployment's time budget runs out
+class MIDeadlineExceeded(Exception) :
+    pass
+
+    # End-to-end time budget for a deployment.  Every wait and 
+    # request in MIDriver takes only what is left of the budget
+    # (see bound), and MIDeadlineExceeded is raised once it is 
+    # gone.  An MIDeadline of None seconds never expires, so 
+    # the per-phase limits apply unchanged.
+    #
+    # Callers can also record the phases they run against the
+    # budget (startPhase / endPhase) for the closing report.
+class MIDeadline:
+    def __init__(self, seconds=None) :
+        self.start = time.time()
+        self.expires = None
+        if seconds != None :
+            self.expires = self.start + seconds
+        self.phases = []
+
+    def remaining(self) :
+        if self.expires == None :
+            return None
+        return max (0.0, self.expires - time.time())
+
+        # Has the budget run out (or nearly, within margin seconds) ?
+    def expired(self, margin=0) :
+        return self.expires != None  and  time.time() + margin >= self.expires
+
+        # timeout (seconds, or None for unlimited) cut down to the
+        # remaining budget
+    def bound(self, timeout) :
+        left = self.remaining()
+        if left == None :
+            return timeout
+        if timeout == None :
+            return left
+        return min (timeout, left)
+
+    def check(self, step) :
+        if self.expired() :
+            raise MIDeadlineExceeded (step)
+
+    def startPhase(self, name) :
+        self.phases.append ({ 'name' : name, 'start' : time.time(), 'end' : None, 'result' : None })
+
+    def endPhase(self, result) :
+        if len(self.phases) > 0 :
+            self.phases[-1]['end'] = time.time()
+            self.phases[-1]['result'] = result
+
+    def report(self) :
+        logger = logging.getLogger()
+        if self.expires == None :
+            logger.info ("Phase timings (no deadline):")
+        else :
+            logger.info ("Phase timings (deadline %ds, %ds left):", self.expires - self.start, self.remaining())
+        for p in self.phases :
+            end = p['end']
+            if end == None :
+                end = time.time()
+            if p['result'] == None :
+                result = "running"
+            elif p['result'] == False :
+                result = "failed"
+            else :
+                result = "ok"
+            logger.info ("  %-12s %8.1fs  %s", p['name'], end - p['start'], result)
+        logger.info ("  %-12s %8.1fs", "TOTAL", time.time() - self.start)
+
+
+    # Monotonic clock where available (time.monotonic is Python 3)
+monotonic = getattr (time, 'monotonic', time.time)
+
+    # Structured progress events for orchestration tools, written 
+    # as JSON lines to a file descriptor ("fd:3") or a Unix domain
+    # socket ("unix:/run/deploy.sock").  Each event is
+    #   { "seq", "event", "time", "mono", ... event fields }
+    # where mono is seconds on the monotonic clock since the stream
+    # was opened (safe for ordering and durations), and time is
+    # wall-clock for display.
+    #
+    # emit() never blocks : events are queued for a writer thread,
+    # and if the consumer falls more than max_queued events behind
+    # further events are dropped (and counted in the summary).
+    # With no target, emit() does nothing.
+class MIEventStream:
+    def __init__(self, target=None, maxQueued=1000) :
+        self.logger = logging.getLogger()
+        self.seq = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.start = monotonic()
+        self.out = None
+        self.queue = None
+        self.writer = None
+        if target == None :
+            return
+
+        try :
+            if target.startswith ("fd:") :
+                self.out = os.fdopen (int(target[3:]), "wb", 0)
+            elif target.startswith ("unix:") :
+                sock = socket.socket (socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect (target[5:])
+                self.out = sock.makefile ("wb", 0)
+            else :
+                self.logger.warn ("Unknown event stream %s (use fd:N or unix:PATH)", target)
+                return
+        except (OSError, IOError, ValueError, socket.error) as e :
+            self.logger.warn ("Cannot open event stream %s: %s", target, e)
+            return
+
+        self.queue = queue.Queue (maxQueued)
+        self.writer = threading.Thread (target=self.drain)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def emit(self, event, **fields) :
+        if self.queue == None :
+            return
+        with self.lock :
+            self.seq += 1
+            fields['seq'] = self.seq
+        fields['event'] = event
+        fields['time'] = time.time()
+        fields['mono'] = round (monotonic() - self.start, 3)
+        try :
+            self.queue.put_nowait (fields)
+        except queue.Full :
+            self.dropped += 1
+
+    def drain(self) :
+        while True :
+            ev = self.queue.get()
+            if ev == None :
+                break
+            try :
+                self.out.write ((json.dumps (ev, sort_keys=True) + "\n").encode('utf-8'))
+            except (IOError, OSError, socket.error) as e :
+                self.logger.warn ("Event stream closed by consumer: %s", e)
+                self.queue = None
+                break
+
+        # Flush what we can (waiting at most "wait" seconds for a 
+        # slow consumer) and close the stream
+    def close(self, wait=2) :
+        q = self.queue
+        if q == None :
+            return
+        if self.dropped > 0 :
+            self.logger.warn ("%d progress events were dropped (slow consumer)", self.dropped)
+        try :
+            q.put (None, True, wait)
+        except queue.Full :
+            pass
+        self.writer.join (wait)
+        self.queue = None
+        try :
+            self.out.close()
+        except (IOError, OSError, socket.error) :
+            pass
+
+
+    # Request priority classes (lower is more urgent)
+PRIORITY_CONFIG = 0         # config / service / group mutations
+PRIORITY_STATE = 1          # process state transitions
+PRIORITY_POLL = 2           # status polls
+PRIORITY_LOG = 3            # process log tails
+
+def requestPriority(method, target) :
+    if target.startswith ("/api/process/log") :
+        return PRIORITY_LOG
+    if method == "GET" :
+        return PRIORITY_POLL
+    if target.startswith ("/api/process") :
+        return PRIORITY_STATE
+    return PRIORITY_CONFIG
+
+
+    # Admission control for requests to the installer service,
+    # which runs on the same node as (and alongside) the ansible
+    # install it is driving.
+    #
+    # Callers acquire() a slot before a request and release() it
+    # with the request's latency and outcome.  At most "limit"
+    # requests are in flight; waiting callers are admitted in
+    # priority order (FIFO within a class).  The limit adapts
+    # AIMD-style, like TCP's congestion window :
+    #   - each good response (latency <= latency_target) grows the
+    #     limit by 1/limit, so about +1 per limit's worth of requests
+    #   - an error or a slow response halves it (at most once per
+    #     latency_target, so one burst of slow responses counts once)
+    # bounded by min_limit and max_limit.
+    #
+    # A caller waiting with a deadline (see MIDeadline) gives up 
+    # with MIDeadlineExceeded once it runs out.
+class MIRequestScheduler:
+    def __init__(self, maxLimit=8, latencyTarget=2.0, minLimit=1) :
+        self.min_limit = minLimit
+        self.max_limit = maxLimit
+        self.latency_target = latencyTarget
+        self.limit = float(minLimit)
+        self.in_flight = 0
+        self.waiting = []
+        self.sequence = 0
+        self.last_decrease = 0
+        self.cond = threading.Condition()
+        self.stats = { 'admitted' : [ 0, 0, 0, 0 ], 'errors' : 0, 'slow' : 0, 'decreases' : 0, 'peak_limit' : float(minLimit) }
+
+    def acquire(self, priority=PRIORITY_POLL, deadline=None) :
+        with self.cond :
+            self.sequence += 1
+            ticket = ( priority, self.sequence )
+            heapq.heappush (self.waiting, ticket)
+            while self.waiting[0] != ticket  or  self.in_flight >= int(self.limit) :
+                left = None
+                if deadline != None :
+                    if deadline.expired() :
+                        self.waiting.remove (ticket)
+                        heapq.heapify (self.waiting)
+                        self.cond.notify_all()
+                        raise MIDeadlineExceeded ("waiting for a request slot")
+                    left = deadline.remaining()
+                self.cond.wait (left)
+            heapq.heappop (self.waiting)
+            self.in_flight += 1
+            self.stats['admitted'][priority] += 1
+                # The next waiter may fit as well
+            self.cond.notify_all()
+        return time.time()
+
+    def release(self, startTime, ok=True) :
+        latency = time.time() - startTime
+        with self.cond :
+            self.in_flight -= 1
+            if ok == False  or  latency > self.latency_target :
+                if ok == False :
+                    self.stats['errors'] += 1
+                else :
+                    self.stats['slow'] += 1
+                if time.time() - self.last_decrease >= self.latency_target :
+                    self.limit = max (float(self.min_limit), self.limit / 2)
+                    self.last_decrease = time.time()
+                    self.stats['decreases'] += 1
+            else :
+                self.limit = min (float(self.max_limit), self.limit + 1.0 / self.limit)
+                self.stats['peak_limit'] = max (self.stats['peak_limit'], self.limit)
+            self.cond.notify_all()
+
+
 class MIDriver:
     def __init__(self, url="https://localhost:9443", user="mapr", passwd="mapr") :
             # All our REST traffic to the Installer uses these headers
-        self.headers = { 'Content-Type' : 'application/json' } 
+            # (responses may come back gzip'ed; requests decodes them)
+        self.headers = { 'Content-Type' : 'application/json', 'Accept-Encoding' : 'gzip, deflate' } 
         self.installer_url = url
         self.installer_session = requests.Session()
         self.mapr_user = user
@@ -63,13 +758,122 @@ class MIDriver:
         self.stage_user = None
         self.stage_password = None
         self.stage_license_url = "http://stage.mapr.com/license"
+        self.license_cache = MILicenseCache()
 
         self.silent_running = False
 
+            # Service catalog index (see getVersionIndex); 
+            # version_index_failed avoids re-reading a catalog
+            # that could not be retrieved.
+        self.version_index = None
+        self.version_index_failed = False
+
+            # Conditional-request cache for polled resources (see 
+            # poll_get).  Maps target to its validators, body digest,
+            # parsed body and whether the last poll saw a change.
+        self.response_cache = {}
+
+            # Request body streaming and compression (see 
+            # encodePayload).  Only if compress_requests is set are
+            # bodies past compress_threshold gzip'ed and streamed
+            # (disabled by default since older installers may not 
+            # accept "Content-Encoding: gzip" or chunked bodies;
+            # otherwise bodies go out whole, with a Content-Length).
+            # wire_stats
+            # accumulates body sizes before/after encoding for both
+            # directions.
+        self.compress_requests = False
+        self.compress_threshold = 64 * 1024
+        self.stream_block = 64 * 1024
+            # Paging for collection iterators (see iter_resources)
+        self.page_size = 500
+        self.page_prefetch = True
+
+        self.wire_stats = { 'requests' : 0, 'sent_json' : 0, 'sent_wire' : 0, 'responses' : 0, 'recv_wire' : 0, 'recv_body' : 0 }
+
+            # Local package mirror (see checkPackageMirror).  When
+            # mirror_url is set the installer pulls packages from it
+            # rather than from package_upstream.  mirror_dir is the
+            # local directory behind mirror_url, needed to prefetch
+            # missing packages into it.
+        self.mirror_url = None
+        self.mirror_dir = None
+        self.mirror_prefetch = False
+        self.package_upstream = PACKAGE_UPSTREAM_URL
+        self.package_os = 'redhat'
+
+            # Progress events (see MIEventStream); disabled unless
+            # set with setEventStream.
+        self.events = MIEventStream()
+
+            # Overall time budget (see MIDeadline); unlimited unless
+            # set with setDeadline.  Reporting run through bestEffort
+            # ignores it, but gets only report_grace seconds.
+        self.deadline = MIDeadline()
+        self.report_grace = 60
+
+            # Concurrency limit and priorities for installer 
+            # requests (see MIRequestScheduler and installer_request)
+        self.scheduler = MIRequestScheduler()
+
             # State variables from REST interface
         self.current_state = None
         self.license_uploaded = False
 
+            # Progress tracking for long-running phases.
+            #   host_progress maps host id to its last observed
+            #   state/status and the time that state last changed.
+            #   Hosts unchanged for stall_window seconds are reported.
+            #   wait_per_host extends the phase deadline for large
+            #   clusters (see waitForProcessState).
+        self.host_progress = {}
+        self.stalled_hosts = []
+        self.stall_window = 300
+        self.wait_per_host = 0
+
+            # Per-host failure isolation during install.
+            #   failed_hosts are hosts seen in an *ERROR state during
+            #   the current phase.  Up to max_failed_hosts of them
+            #   (none of which may carry a quorum service) are retried
+            #   on their own, host_retry_attempts times with an
+            #   exponential backoff starting at host_retry_backoff
+            #   seconds.  Hosts that never succeed are quarantined
+            #   (dropped from the cluster config) and listed in
+            #   quarantined_hosts so the rest of the cluster completes.
+        self.failed_hosts = []
+        self.quarantined_hosts = []
+        self.max_failed_hosts = 0
+        self.host_retry_attempts = 2
+        self.host_retry_backoff = 30
+        self.quorum_services = [ 'zookeeper', 'cldb', 'resourcemanager' ]
+
+            # Rolling upgrade (see rollingUpgrade).  Hosts without
+            # quorum services are upgraded upgrade_batch_size at a time.
+        self.upgrade_batch_size = 10
+
+            # Scale-in (see removeNodes).  At most drain_concurrency
+            # hosts are drained at once, each within drain_timeout.
+        self.drain_concurrency = 4
+        self.drain_timeout = 1800
+
+            # Group and service host layout loaded by applySnapshot,
+            # applied in place of updateClusterConfig after PROVISIONING
+        self.snapshot_layout = None
+
+            # Post-install endpoint verification (see verifyServices).
+            # Services (MCS in particular) take a while to come up
+            # after COMPLETED, so down endpoints are probed again
+            # every verify_interval seconds for up to verify_grace.
+        self.probe_timeout = 3
+        self.probe_concurrency = 32
+        self.verify_grace = 300
+        self.verify_interval = 15
+
+            # VM shape (key into VM_PROFILES) and the tuning derived
+            # from it by computeVmTuning
+        self.vm_size = None
+        self.vm_tuning = None
+
             # And our logger (use global default logger for now)
         self.logger = logging.getLogger()
 
@@ -115,55 +919,314 @@ class MIDriver:
         if newPassword != None : 
             self.stage_password = newPassword
 
+    def setLicenseCache(self, newDir, newOffline=None) :
+        if newDir != None :
+            self.license_cache.cache_dir = newDir
+        if newOffline == True :
+            self.license_cache.offline = True
+        elif newOffline == False :
+            self.license_cache.offline = False
+
     def setHosts(self, newHosts) :
         self.logger.debug ("MIDriver::setHosts(%s)", ','.join(newHosts))
         if newHosts != None :
             self.hosts = newHosts
             self.logger.debug ("  self.hosts = %s", ','.join(self.hosts))
 
+    def setStallWindow(self, newWindow) :
+        if newWindow != None  and  newWindow > 0 :
+            self.stall_window = newWindow
+
+    def setVerifyGrace(self, newGrace) :
+        if newGrace != None  and  newGrace >= 0 :
+            self.verify_grace = newGrace
+
+    def setWaitPerHost(self, newWait) :
+        if newWait != None  and  newWait >= 0 :
+            self.wait_per_host = newWait
+
+    def setFailedHostPolicy(self, maxFailed, retryAttempts=None, retryBackoff=None) :
+        if maxFailed != None  and  maxFailed >= 0 :
+            self.max_failed_hosts = maxFailed
+        if retryAttempts != None  and  retryAttempts >= 0 :
+            self.host_retry_attempts = retryAttempts
+        if retryBackoff != None  and  retryBackoff >= 0 :
+            self.host_retry_backoff = retryBackoff
+
+    def setCompressRequests(self, newCompress, newThreshold=None) :
+        if newCompress == True :
+            self.compress_requests = True
+        elif newCompress == False :
+            self.compress_requests = False
+        if newThreshold != None  and  newThreshold >= 0 :
+            self.compress_threshold = newThreshold
+
+    def setPageSize(self, newSize, newPrefetch=None) :
+        if newSize != None  and  newSize > 0 :
+            self.page_size = newSize
+        if newPrefetch == True :
+            self.page_prefetch = True
+        elif newPrefetch == False :
+            self.page_prefetch = False
+
+    def setUpgradeBatchSize(self, newSize) :
+        if newSize != None  and  newSize > 0 :
+            self.upgrade_batch_size = newSize
+
+    def setDrainConcurrency(self, newLimit, newTimeout=None) :
+        if newLimit != None  and  newLimit > 0 :
+            self.drain_concurrency = newLimit
+        if newTimeout != None  and  newTimeout > 0 :
+            self.drain_timeout = newTimeout
+
+    def setVmSize(self, newSize) :
+        if newSize != None :
+            if newSize in VM_PROFILES :
+                self.vm_size = newSize
+            else :
+                self.logger.warn ("Unknown VM size %s; no VM-specific tuning", newSize)
+
+    def setEventStream(self, newEvents) :
+        if newEvents != None :
+            self.events = newEvents
+
+    def setDeadline(self, newDeadline) :
+        if newDeadline != None :
+            self.deadline = newDeadline
+
+    def setRequestConcurrency(self, newMax, newLatencyTarget=None) :
+        if newMax != None  and  newMax > 0 :
+            self.scheduler.max_limit = newMax
+            self.scheduler.limit = min (self.scheduler.limit, float(newMax))
+        if newLatencyTarget != None  and  newLatencyTarget > 0 :
+            self.scheduler.latency_target = newLatencyTarget
+
+    def setPackageMirror(self, newUrl, newDir=None, newPrefetch=None, newUpstream=None) :
+        if newUrl != None :
+            self.mirror_url = newUrl.rstrip('/')
+        if newDir != None :
+            self.mirror_dir = newDir
+        if newPrefetch == True :
+            self.mirror_prefetch = True
+        elif newPrefetch == False :
+            self.mirror_prefetch = False
+        if newUpstream != None :
+            self.package_upstream = newUpstream.rstrip('/')
+
     def setDisks(self, newDisks) :
         self.logger.debug ("MIDriver::setDisks(%s)", ','.join(newDisks))
         if newDisks != None :
             self.disks = newDisks
             self.logger.debug ("  self.disks = %s", ','.join(self.disks))
 
-    def swagger_get(self,target) :
+        # Every REST call to the installer goes through here, 
+        # admitted by the request scheduler at the priority of its
+        # class (see requestPriority).  Connection errors and 5xx
+        # responses count against the concurrency limit.
+        #
+        # Requests are limited to the remaining deadline budget; 
+        # one that times out because the budget ran out raises
+        # MIDeadlineExceeded.
+    def installer_request(self, method, target, priority=None, **kwargs) :
+        step = method + " " + target
+        self.deadline.check (step)
+        if priority == None :
+            priority = requestPriority (method, target)
+        kwargs.setdefault ('headers', self.headers)
+        kwargs.setdefault ('timeout', self.deadline.bound (None))
+        startTime = self.scheduler.acquire (priority, self.deadline)
+        ok = False
+        try :
+            r = self.installer_session.request (method, self.installer_url + target,
+                auth = (self.mapr_user, self.mapr_password),
+                verify = False,
+                **kwargs)
+            ok = r.status_code < 500
+            if kwargs.get('stream') != True :
+                self.recordResponse (r)
+        except requests.Timeout :
+            if self.deadline.expired (1) :
+                raise MIDeadlineExceeded (step)
+            raise
+        finally :
+            self.scheduler.release (startTime, ok)
+        return r
+
+    def logSchedulerStats(self) :
+        ss = self.scheduler.stats
+        self.logger.info ("Installer requests: %d config, %d state, %d poll, %d log; %d errors, %d slow, concurrency limit %.1f (peak %.1f, %d decreases)",
+            ss['admitted'][PRIORITY_CONFIG], ss['admitted'][PRIORITY_STATE], ss['admitted'][PRIORITY_POLL], ss['admitted'][PRIORITY_LOG],
+            ss['errors'], ss['slow'], self.scheduler.limit, ss['peak_limit'], ss['decreases'])
+
+    def swagger_get(self,target,extraHeaders=None) :
         self.logger.debug ("MIDriver::swagger_get(%s)", target)
+        hdrs = self.headers
+        if extraHeaders != None :
+            hdrs = dict(self.headers)
+            hdrs.update (extraHeaders)
         errcnt = 0
         while errcnt < 5 :
             try :
-                r = self.installer_session.get(self.installer_url + target,
-                    auth = (self.mapr_user, self.mapr_password),
-                    headers = self.headers,
-                    verify = False)
+                r = self.installer_request ("GET", target, headers = hdrs)
             except requests.ConnectionError :
                 errcnt += 1
                 self.logger.debug ("  connection error %d", errcnt)
+                self.events.emit ('retry', what = "GET " + target, attempt = errcnt, reason = "connection error")
             else :
-                if r.headers['Content-Type'] == 'application/json' :
-                    dbgStr = json.dumps(r.json(),indent=4,sort_keys=True)
-                else :
-                    dbgStr = r.text
-                self.logger.debug ("  rval: "+dbgStr)
+                if self.logger.isEnabledFor (logging.DEBUG)  and  r.status_code != requests.codes.not_modified :
+                    self.logger.debug ("  rval: "+r.text)
                 return r
 
+        # GET a resource we poll repeatedly, returning a tuple of
+        # (parsed body, changed).  The ETag / Last-Modified validators
+        # from the previous response are sent back so the installer
+        # can answer "304 Not Modified" without a body.  If the 
+        # installer doesn't support validators, the body digest is
+        # compared instead so an unchanged body is not parsed again.
+        # Either way the cached body is returned with changed=False.
+        #
+        # If given, convert is applied to the parsed body once and 
+        # its result cached in place of the body (callers must use 
+        # the same convert for a given target).
+    def poll_get(self,target,convert=None) :
+        entry = self.response_cache.get(target)
+        condHeaders = {}
+        if entry != None :
+            if entry['etag'] != None :
+                condHeaders['If-None-Match'] = entry['etag']
+            if entry['last_modified'] != None :
+                condHeaders['If-Modified-Since'] = entry['last_modified']
+
+        r = self.swagger_get (target, condHeaders)
+        if r == None :
+            return (None, False)
+
+        if r.status_code == requests.codes.not_modified  and  entry != None :
+            entry['changed'] = False
+            return (entry['body'], False)
+        elif r.status_code != requests.codes.ok :
+            return (None, False)
+
+        digest = hashlib.sha1(r.content).hexdigest()
+        if entry != None  and  entry['digest'] == digest :
+            entry['etag'] = r.headers.get('ETag')
+            entry['last_modified'] = r.headers.get('Last-Modified')
+            entry['changed'] = False
+            return (entry['body'], False)
+
+        body = r.json()
+        if convert != None :
+            body = convert (body)
+        entry = { 'etag' : r.headers.get('ETag'), 
+            'last_modified' : r.headers.get('Last-Modified'),
+            'digest' : digest,
+            'body' : body,
+            'changed' : True }
+        self.response_cache[target] = entry
+        return (entry['body'], True)
+
+        # Typed pollers for the process and host resources
+    def poll_process(self) :
+        return self.poll_get ("/api/process", MIProcess)
+
+    def poll_hosts(self) :
+        return self.poll_get ("/api/hosts", hostList)
+
+        # Did the most recent poll_get of target see new content ?
+    def poll_changed(self,target) :
+        entry = self.response_cache.get(target)
+        if entry == None :
+            return True
+        return entry['changed']
+
+        # Serialize payload for the wire, returning (data, headers).
+        # The JSON is encoded incrementally.  Bodies smaller than 
+        # compress_threshold, and all bodies unless compression is
+        # enabled, are sent as they are (with a Content-Length).
+        # With compression, larger ones are returned as a generator
+        # gzip'ing on the fly (sent with chunked transfer encoding),
+        # so large host/service payloads are never held in memory
+        # as a single string.
+    def encodePayload(self, payload) :
+        self.wire_stats['requests'] += 1
+        chunks = json.JSONEncoder().iterencode(payload)
+        head = []
+        headLen = 0
+        for chunk in chunks :
+            chunk = chunk.encode('utf-8')
+            head.append (chunk)
+            headLen += len(chunk)
+            if headLen >= self.compress_threshold :
+                break
+        else :
+            self.wire_stats['sent_json'] += headLen
+            self.wire_stats['sent_wire'] += headLen
+            return (b''.join(head), self.headers)
+
+        rest = ( c.encode('utf-8') for c in chunks )
+        if self.compress_requests == False :
+            data = b''.join (itertools.chain (head, rest))
+            self.wire_stats['sent_json'] += len(data)
+            self.wire_stats['sent_wire'] += len(data)
+            return (data, self.headers)
+
+        hdrs = dict(self.headers)
+        hdrs['Content-Encoding'] = 'gzip'
+        return (self.streamPayload (itertools.chain (head, rest), True), hdrs)
+
+        # Generator of the wire blocks (about stream_block bytes 
+        # each) of an encoded body
+    def streamPayload(self, chunks, compress) :
+        gz = None
+        if compress == True :
+            gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        block = []
+        blockLen = 0
+        for chunk in chunks :
+            self.wire_stats['sent_json'] += len(chunk)
+            if gz != None :
+                chunk = gz.compress (chunk)
+            block.append (chunk)
+            blockLen += len(chunk)
+            if blockLen >= self.stream_block :
+                self.wire_stats['sent_wire'] += blockLen
+                yield b''.join(block)
+                block = []
+                blockLen = 0
+        if gz != None :
+            block.append (gz.flush())
+            blockLen += len(block[-1])
+        if blockLen > 0 :
+            self.wire_stats['sent_wire'] += blockLen
+            yield b''.join(block)
+
+        # Response sizes as transferred (Content-Length is the 
+        # compressed size when the installer gzip'ed the body)
+    def recordResponse(self, r) :
+        bodyLen = len(r.content)
+        self.wire_stats['responses'] += 1
+        self.wire_stats['recv_body'] += bodyLen
+        self.wire_stats['recv_wire'] += int(r.headers.get('Content-Length', bodyLen))
+
+        # Traffic totals, plus the driver's peak memory (ru_maxrss 
+        # is in KB on Linux)
+    def logWireStats(self) :
+        ws = self.wire_stats
+        self.logger.info ("Installer traffic: %d requests (%d bytes JSON, %d bytes sent), %d responses (%d bytes received, %d bytes decoded)",
+            ws['requests'], ws['sent_json'], ws['sent_wire'], ws['responses'], ws['recv_wire'], ws['recv_body'])
+        self.logger.info ("Driver peak memory: %.1f MB", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
     def swagger_patch(self, target, payload) :
         self.logger.debug ("MIDriver::swagger_patch(%s, %s)", target, payload)
-        r = self.installer_session.patch(self.installer_url + target,
-                auth = (self.mapr_user, self.mapr_password),
-                headers = self.headers,
-                verify = False,
-                data = json.dumps(payload))
+        (data, hdrs) = self.encodePayload (payload)
+        r = self.installer_request ("PATCH", target, headers = hdrs, data = data)
         if r.status_code != requests.codes.ok :
             self.logger.warn ("MIDriver::swagger_patch(%s, %s) returned bad status %d", target, payload, r.status_code)
 
     def swagger_post(self, target, payload) :
         self.logger.debug ("MIDriver::swagger_post(%s, %s)", target, payload)
-        r = self.installer_session.post(self.installer_url + target,
-                auth = (self.mapr_user, self.mapr_password),
-                headers = self.headers,
-                verify = False,
-                data = json.dumps(payload))
+        (data, hdrs) = self.encodePayload (payload)
+        r = self.installer_request ("POST", target, headers = hdrs, data = data)
         if r.status_code != requests.codes.ok :
             self.logger.warn ("MIDriver::swagger_post(%s, %s) returned bad status %d", target, payload, r.status_code)
 
@@ -175,11 +1238,7 @@ class MIDriver:
 
     def groups_get(self,groupName) :
         payload = { 'label' : groupName}
-        r = self.installer_session.get(self.installer_url + "/api/groups",
-                auth = (self.mapr_user, self.mapr_password),
-                headers = self.headers,
-                params = payload, 
-                verify = False)
+        r = self.installer_request ("GET", "/api/groups", params = payload)
         return r
 
     def process_get(self) :
@@ -188,35 +1247,188 @@ class MIDriver:
     def process_patch(self,payload) :
         self.swagger_patch ("/api/process", payload)
 
+    def hosts_get(self) :
+        return self.swagger_get("/api/hosts")
+
+        # Retrieve one page of a collection (None on failure)
+    def page_get(self, target, payload, offset, limit) :
+        params = dict(payload)
+        params['offset'] = offset
+        params['limit'] = limit
+        r = self.installer_request ("GET", target, params = params)
+        if r.status_code != requests.codes.ok :
+            self.logger.warn ("MIDriver::page_get(%s, offset=%d) returned bad status %d", target, offset, r.status_code)
+            return None
+        return r.json()
+
+        # Generator over every resource in an installer collection 
+        # (/api/hosts, /api/services, /api/groups), requested 
+        # pageSize entries at a time with offset/limit.  With prefetch
+        # enabled the next page is fetched in the background while 
+        # the caller works through the current one.  Only one or two 
+        # pages are held at a time, and callers can stop early.
+        #
+        # Paging continues while offset is below "count" (servers may
+        # cap pages below pageSize) or, for installers that give no
+        # count, while pages come back full.  Installers that ignore
+        # offset/limit return everything in the first response; 
+        # "count" then equals the page length and iteration stops 
+        # after that page.
+        #
+        # A first page that can't be read ends the iteration (as 
+        # before); a later one raises, so callers never act on 
+        # part of a collection as if it were all of it.
+    def iter_resources(self, target, payload=None, pageSize=None, prefetch=None) :
+        if payload == None :
+            payload = {}
+        if pageSize == None :
+            pageSize = self.page_size
+        if prefetch == None :
+            prefetch = self.page_prefetch
+
+        offset = 0
+        page = self.page_get (target, payload, offset, pageSize)
+        while page != None :
+            resources = page.get('resources', [])
+            total = page.get('count')
+            offset += len(resources)
+            if total != None :
+                more = len(resources) > 0  and  offset < total
+            else :
+                more = len(resources) >= pageSize
+
+            fetcher = None
+            if more  and  prefetch == True :
+                nextPage = {}
+                def fetch(o=offset) :
+                    try :
+                        nextPage['page'] = self.page_get (target, payload, o, pageSize)
+                    except Exception as e :
+                        nextPage['error'] = e
+                fetcher = threading.Thread (target = fetch)
+                fetcher.daemon = True
+                fetcher.start()
+
+            for res in resources :
+                yield res
+
+            if not more :
+                break
+            elif fetcher != None :
+                fetcher.join()
+                if 'error' in nextPage :
+                    raise nextPage['error']
+                page = nextPage.get('page')
+            else :
+                page = self.page_get (target, payload, offset, pageSize)
+            if page == None :
+                raise requests.RequestException ("%s : page at offset %d could not be read" % (target, offset))
+
+    def iter_hosts(self, payload=None, pageSize=None) :
+        return self.iter_resources ("/api/hosts", payload, pageSize)
+
+    def iter_services(self, payload=None, pageSize=None) :
+        return self.iter_resources ("/api/services", payload, pageSize)
+
+    def iter_groups(self, payload=None, pageSize=None) :
+        return self.iter_resources ("/api/groups", payload, pageSize)
+
     def services_get(self,payload=None) :
-        r = self.installer_session.get(self.installer_url + "/api/services",
-                auth = (self.mapr_user, self.mapr_password),
-                headers = self.headers,
-                params = payload, 
-                verify = False)
+        r = self.installer_request ("GET", "/api/services", params = payload)
         return r
 
+        # Build the service catalog index on first use.  If the
+        # catalog can't be retrieved we return None and callers
+        # fall back to per-service queries.
+    def getVersionIndex(self) :
+        if self.version_index == None  and  self.version_index_failed == False :
+            try :
+                vindex = MIVersionIndex (self.iter_services())
+            except requests.RequestException as e :
+                self.logger.warn ("Service catalog incomplete (%s)", e)
+                vindex = MIVersionIndex ([])
+            if len(vindex.packages) == 0 :
+                self.logger.warn ("Unable to retrieve service catalog")
+                self.version_index_failed = True
+                return None
+            self.version_index = vindex
+            self.logger.debug ("MIDriver::getVersionIndex: %d packages", len(self.version_index.packages))
+        return self.version_index
+
     def service_available(self,sname,sversion) :
+        vindex = self.getVersionIndex()
+        if vindex != None :
+            return vindex.available ("mapr-"+sname, sversion)
+
+        return ( self.get_service (sname, sversion) != None )
+
+        # Translate "latest" into the highest catalog version
+        # compatible with our core version.  Other versions are
+        # returned as the catalog spells them (or unchanged if
+        # the catalog doesn't list them).
+    def resolve_service_version(self,sname,sversion) :
+        if sversion == None  or  sversion.lower() == "none" :
+            return sversion
+
+        vindex = self.getVersionIndex()
+        if sversion.lower() != "latest" :
+            if vindex != None :
+                canonical = vindex.canonical ("mapr-"+sname, sversion)
+                if canonical != None :
+                    return canonical
+            return sversion
+
+        if vindex == None :
+            return None
+        latest = vindex.latest ("mapr-"+sname, self.mapr_version)
+        self.logger.info ("Resolved %s=latest to version %s", sname, latest)
+        return latest
+
+        # Single service entry (None if the installer has none)
+    def get_service(self,sname,sversion) :
         payload = { 'name' : "mapr-"+sname, 'version' : sversion } 
         r = self.services_get (payload)
-        return ( r.json()['count'] != 0 )
+        if r.status_code != requests.codes.ok :
+            return None
+        body = r.json()
+        if body['count'] == 0 :
+            return None
+        return MIServiceEntry (body['resources'][0])
+
+        # Group by label (None if not exactly one such group).
+        # The group collection may omit membership, so withHosts 
+        # fetches the group resource itself.
+    def get_group(self,groupName,withHosts=False) :
+        r = self.groups_get (groupName)
+        body = r.json()
+        if body['count'] != 1 :
+            return None
+        grp = body['resources'][0]
+        if withHosts == True  and  'hosts' not in grp :
+            grp = self.swagger_get ("/api/groups/"+str(grp['id'])).json()
+        return MIGroup (grp)
+
+    def get_process(self) :
+        (proc, changed) = self.poll_process()
+        return proc
 
     def get_service_hosts(self,sname,sversion) :
-        payload = { 'name' : "mapr-"+sname, 'version' : sversion } 
-        r = self.services_get (payload)
-        return ( r.json()['resources'][0]['hosts'] )
+        svc = self.get_service (sname, sversion)
+        if svc == None :
+            return []
+        return ( svc.hosts )
 
         # For services that have defined ui ports, this
         # routine assemples a list of "host:port" to return
     def get_service_url(self,sname,sversion) :
-        payload = { 'name' : "mapr-"+sname, 'version' : sversion } 
-        r = self.services_get (payload)
-        resources=r.json()['resources'][0]
+        svc = self.get_service (sname, sversion)
+        if svc == None :
+            return []
 
         urls = []
-        for h in resources['hosts'] :
-            if 'ui_ports' in resources : 
-                for p in resources['ui_ports'] :
+        for h in svc.hosts :
+            if len(svc.ui_ports) > 0 : 
+                for p in svc.ui_ports :
                     urls.append(h+':'+str(p))
             else :
                 urls.append(h)
@@ -254,12 +1466,12 @@ class MIDriver:
             # ecosystem packages before we initialize the 
             # list in the Installer itself.
     def initializeEcoServicesList (self) :
-        if self.mapr_version < '5.0.0' : 
+        if versionCompare (self.mapr_version, '5.0.0') < 0 : 
             self.eco_defaults['hive'] = '0.13'
             self.eco_defaults['pig'] = '0.14'
 
             # Always include Kafka for MapR-Streams Support (5.x and higher)
-        if self.mapr_version >= '5.1.0' : 
+        if versionCompare (self.mapr_version, '5.1.0') >= 0 : 
             self.eco_defaults['kafka'] = '0.9.0'
 
         ver = self.eco_defaults.get('hbase')
@@ -289,6 +1501,7 @@ class MIDriver:
 
         # MapRDB
     def addMapRDBServices (self, hbase_version = None) :
+        hbase_version = self.resolve_service_version ('hbase', hbase_version)
         if hbase_version == None :
             hbase_version = self.eco_defaults.get('hbase', "0.98")
         elif hbase_version.lower() == "none" :
@@ -309,6 +1522,7 @@ class MIDriver:
 
         # Hive (with only local MySQL supported for now)
     def addHiveServices (self, hive_version = None, hive_user = None, hive_password = None, hive_db = "local") :
+        hive_version = self.resolve_service_version ('hive', hive_version)
         if hive_version == None :
             hive_version = self.eco_defaults.get('hive', "1.0")
         elif hive_version.lower() == "none" :
@@ -342,6 +1556,7 @@ class MIDriver:
     
         # Spark service
     def addSparkServices (self, spark_version = None) :
+        spark_version = self.resolve_service_version ('spark', spark_version)
         if spark_version == None :
             spark_version = self.eco_defaults.get('spark', "1.4.1")
         elif spark_version.lower() == "none" :
@@ -359,6 +1574,7 @@ class MIDriver:
         # Basic ecosystem service ... no extra work for config
     def addEcoServices (self, eco_service = None, eco_version = None) :
         svc = 'mapr-' + eco_service
+        eco_version = self.resolve_service_version (eco_service, eco_version)
 
         if eco_version == None  or  eco_version == None :
             return
@@ -375,6 +1591,9 @@ class MIDriver:
 
     def initializeClusterConfig(self) :
         self.logger.debug ("MIDriver::initializeClusterConfig()")
+        if self.configurePackageMirror() == False :
+            return (False)
+
         payload = { 'cluster_admin_password' : self.mapr_password } 
         self.config_patch(payload)
 
@@ -400,6 +1619,9 @@ class MIDriver:
 
         if len(self.disks) > 0 :
             payload = { 'disks' : self.disks }
+            self.vm_tuning = self.computeVmTuning()
+            if self.vm_tuning != None :
+                payload['disk_stripe'] = self.vm_tuning['disk_stripe']
             self.config_patch(payload)
         else :
             self.logger.warn ("initializeClusterConfig called when no disks were specified")
@@ -416,7 +1638,11 @@ class MIDriver:
 #            payload = { 'licenseType' : self.mapr_edition, 'licenseValidation' : 'INSTALL' } 
 #            self.config_patch(payload)
 
-        # Specify the services
+        # Specify the services (with per-service memory from the
+        # VM tuning, if any)
+        if self.vm_tuning != None :
+            for svc in self.vm_tuning['service_memory'] :
+                self.services[svc]['heapsize_mb'] = self.vm_tuning['service_memory'][svc]
         payload = { 'services' : self.services } 
         self.config_patch(payload)
 
@@ -443,6 +1669,171 @@ class MIDriver:
         return rc
 
 
+        # Relative repository paths for core and ecosystem packages
+    def packageRepoPaths(self) :
+        major = versionKey(self.mapr_version)[0][0]
+        return { 'core' : "v%s/%s" % (self.mapr_version, self.package_os),
+            'eco' : "ecosystem-%d.x/%s" % (major, self.package_os) }
+
+        # Packages (with dependencies) for self.services that the
+        # repositories under baseUrl do not have, as a list of 
+        # (repo path, package, version).  Dependencies are looked
+        # up in both repositories; one that neither has is listed
+        # under the core path (MapR packages other packages depend
+        # on are core ones).  Returns None if a repository could 
+        # not be read.
+    def missingPackages(self, baseUrl) :
+        paths = self.packageRepoPaths()
+        repos = {}
+        for kind in paths :
+            repos[kind] = MIPackageRepo (baseUrl + "/" + paths[kind], self.deadline.bound (60))
+            if repos[kind].load() == False :
+                self.logger.error ("Cannot read package repository %s", repos[kind].url)
+                return None
+
+        missing = []
+        for svc in sorted (self.services) :
+            pkg = SERVICE_PACKAGES.get (svc, svc)
+            version = self.services[svc].get('version')
+            if pkg == None  or  version == None :
+                continue
+            kind = svc in MAPR_CORE_SERVICES and 'core' or 'eco'
+            others = [ repos[k] for k in sorted (repos) if k != kind ]
+            for (name, (repo, entry)) in repos[kind].closure(pkg, version, others).items() :
+                if entry != None :
+                    continue
+                if name == pkg :
+                    missing.append ( (paths[kind], name, version) )
+                else :
+                    missing.append ( (paths['core'], name, None) )
+        return sorted (set (missing))
+
+        # Verify (before INIT) that the mirror has every package in
+        # self.services, prefetching the missing ones from upstream
+        # if so configured, then point the installer at the mirror.
+        # Returns False if packages are still missing.
+    def configurePackageMirror(self) :
+        if self.mirror_url == None :
+            return (True)
+
+        missing = self.missingPackages (self.mirror_url)
+        if missing != None  and  len(missing) > 0  and  self.mirror_prefetch == True :
+            self.prefetchPackages (missing)
+            missing = self.missingPackages (self.mirror_url)
+        if missing == None :
+            return (False)
+        if len(missing) > 0 :
+            for (path, name, version) in missing :
+                self.logger.error ("Package mirror %s/%s is missing %s %s", self.mirror_url, path, name, version or "")
+            return (False)
+
+        self.logger.info ("Installing from package mirror %s", self.mirror_url)
+        self.config_patch ( { 'repo_core_url' : self.mirror_url, 'repo_eco_url' : self.mirror_url } )
+        return (True)
+
+        # Copy packages from upstream into mirror_dir (laid out as
+        # upstream is) and regenerate the repository metadata.
+        # A package not found under its listed path is looked for
+        # in the other repository paths too.
+    def prefetchPackages(self, missing) :
+        if self.mirror_dir == None :
+            self.logger.warn ("No local mirror directory given; cannot prefetch packages")
+            return
+
+        updated = set()
+        upstream = {}
+        allPaths = sorted (self.packageRepoPaths().values())
+        for (listed, name, version) in missing :
+            entry = None
+            for path in [ listed ] + [ p for p in allPaths if p != listed ] :
+                if path not in upstream :
+                    upstream[path] = MIPackageRepo (self.package_upstream + "/" + path, self.deadline.bound (60))
+                    if upstream[path].load() == False :
+                        self.logger.error ("Cannot read upstream repository %s", upstream[path].url)
+                entry = upstream[path].find (name, version)
+                if entry != None :
+                    break
+            if entry == None :
+                self.logger.warn ("Package %s %s not found upstream", name, version or "")
+                continue
+
+                # Failed downloads are logged and the package left 
+                # missing, for the re-check to report.
+            localFile = os.path.join (self.mirror_dir, path, entry['href'])
+            self.logger.info ("Prefetching %s %s into %s", name, entry['version'], localFile)
+            try :
+                if not os.path.isdir (os.path.dirname(localFile)) :
+                    os.makedirs (os.path.dirname(localFile))
+                r = requests.get (upstream[path].url + "/" + entry['href'], stream=True, 
+                    timeout=self.deadline.bound (60))
+                if r.status_code != requests.codes.ok :
+                    self.logger.warn ("Download of %s returned bad status %d", entry['href'], r.status_code)
+                    continue
+                with open (localFile + ".part", "wb") as pf :
+                    for chunk in r.iter_content (1024 * 1024) :
+                        pf.write (chunk)
+                os.rename (localFile + ".part", localFile)
+            except (requests.RequestException, IOError, OSError) as e :
+                self.logger.warn ("Prefetch of %s %s failed : %s", name, entry['version'], e)
+                if os.path.exists (localFile + ".part") :
+                    os.remove (localFile + ".part")
+                continue
+            updated.add (path)
+
+        for path in updated :
+            try :
+                rc = subprocess.call ([ "createrepo", "--update", os.path.join (self.mirror_dir, path) ])
+            except OSError as e :
+                self.logger.warn ("Cannot run createrepo for %s : %s", os.path.join (self.mirror_dir, path), e)
+                continue
+            if rc != 0 :
+                self.logger.warn ("createrepo failed (%d) for %s", rc, os.path.join (self.mirror_dir, path))
+
+
+        # Derive storage pool layout and service memory from the
+        # VM profile (see VM_PROFILES) :
+        #   disk_stripe : disks per storage pool.  Standard_LRS disks
+        #       are slow individually, so they are striped 4 wide;
+        #       premium nodes stripe all their (4) disks together 
+        #       rather than the default 3+1 split that leaves one
+        #       disk in a pool of its own.  A divisor of the disk 
+        #       count is preferred so every pool has the same width.
+        #   service_memory : MB per service from SERVICE_MEMORY_SHARES
+        #       for the services in self.services; NodeManager gets 
+        #       the remainder.
+        # Returns None when no (known) VM size has been set.
+    def computeVmTuning(self) :
+        if self.vm_size == None :
+            return None
+        profile = VM_PROFILES[self.vm_size]
+
+        ndisks = len(self.disks)
+        maxStripe = profile['premium'] and 8 or 4
+        stripe = 1
+        for w in range (1, min(ndisks, maxStripe) + 1) :
+            if ndisks % w == 0 :
+                stripe = w
+        if stripe == 1  and  ndisks > 1 :
+            stripe = min(ndisks, maxStripe)
+
+        totalMb = profile['memory_gb'] * 1024
+        remaining = totalMb - max (totalMb * OS_MEMORY_SHARE[0] // 100, OS_MEMORY_SHARE[1])
+        svcMemory = {}
+        for svc in sorted(SERVICE_MEMORY_SHARES) :
+            if svc in self.services :
+                (pct, floor) = SERVICE_MEMORY_SHARES[svc]
+                svcMemory[svc] = max (totalMb * pct // 100, floor)
+                remaining -= svcMemory[svc]
+        if 'mapr-nodemanager' in self.services :
+            svcMemory['mapr-nodemanager'] = max (remaining, 1024)
+
+        tuning = { 'disk_stripe' : stripe, 'storage_pools' : max((ndisks + stripe - 1) // stripe, 1), 'service_memory' : svcMemory }
+        self.logger.info ("VM tuning for %s (%d GB, %d %s disks): %d storage pool(s) of %d disks; memory (MB) %s",
+            self.vm_size, profile['memory_gb'], ndisks, profile['premium'] and "premium" or "standard",
+            tuning['storage_pools'], stripe, json.dumps(svcMemory, sort_keys=True))
+        return tuning
+
+
         # The default service provisioning can leave "gaps";
         # fix those here.
         #   1.  node0 always has webserver 
@@ -463,16 +1854,14 @@ class MIDriver:
 
             # Option 1: bulk ... definitely quicker than 
             # loop approach below.
-        r = self.groups_get('DATA')
-        if r.json()['count'] == 1 :
-            groupId = r.json()['resources'][0]['id']
-            grp_target="/api/groups/"+str(groupId)
+        grp = self.get_group('DATA')
+        if grp != None :
+            grp_target="/api/groups/"+str(grp.id)
             self.swagger_patch (grp_target, {"hosts" : self.hosts})
 
-        r = self.groups_get('CLIENT')
-        if r.json()['count'] == 1 :
-            groupId = r.json()['resources'][0]['id']
-            grp_target="/api/groups/"+str(groupId)
+        grp = self.get_group('CLIENT')
+        if grp != None :
+            grp_target="/api/groups/"+str(grp.id)
             self.swagger_patch (grp_target, {"hosts" : self.hosts})
 
             # Option 2: 1-at-a-time
@@ -484,23 +1873,27 @@ class MIDriver:
         # If access to the license stage repository has
         # been specified, download trial license and 
         # put into the configuration.
+        # Trial licenses come from the license cache (see 
+        # MILicenseCache), which only goes to the stage server when
+        # it has no valid copy.  In offline mode no stage user is
+        # needed.
     def configureTrialLicense(self) :
-        if self.stage_user == None  or  self.mapr_edition == 'M3' :
+        if self.mapr_edition == 'M3' :
+            return 
+        if self.stage_user == None  and  self.license_cache.offline == False :
             return 
 
         self.logger.info ( "configureTrialLicense: user %s for edition %s", self.stage_user, self.mapr_edition )
 
         license_url = self.stage_license_url + "/LatestDemoLicense-" + self.mapr_edition + ".txt"
 
-        license = requests.get(license_url,
-                auth = (self.stage_user, self.stage_password),
-                headers = { 'Content-Type' : 'text/plain' }) 
-
-        if license.reason != 'OK' :
+        license = self.license_cache.get (license_url, self.mapr_edition, self.stage_user, self.stage_password,
+            self.deadline.bound (self.license_cache.timeout))
+        if license == None :
             self.logger.info ( "Failed to retrieve trial license" )
             return False
 
-        self.config_patch ( {'license' : license.text} )
+        self.config_patch ( {'license' : license} )
         self.license_uploaded = True
 
 
@@ -508,17 +1901,47 @@ class MIDriver:
         # If state returns anything other than $tgtState 
         # or ${tgtState%ING}ED, return failure
         #
-    def waitForProcessState (self,tgtState, maxWait=600, waitInterval=5) :
+        # The deadline is maxWait plus perHostWait for every host
+        # in the cluster, so that large clusters are not cut off
+        # by a limit sized for 3 nodes (but never beyond what is 
+        # left of the overall budget; running out of that raises
+        # MIDeadlineExceeded).  While waiting, per-host
+        # progress is tracked (see trackHostProgress) to report 
+        # stalled hosts and an estimated time to completion.
+        #
+    def waitForProcessState (self,tgtState, maxWait=600, waitInterval=5, perHostWait=None) :
+        if perHostWait == None :
+            perHostWait = self.wait_per_host
+        maxWait = self.deadline.bound (maxWait + perHostWait * len(self.hosts))
+
+        self.host_progress = {}
+        self.stalled_hosts = []
+        self.failed_hosts = []
+        startTime = time.time()
+        curState = self.current_state
+
         while ( maxWait > 0 ) :
-            r = self.process_get()
-            curState = r.json()['state']
+            (proc, changed) = self.poll_process()
+            if proc == None :
+                maxWait -= waitInterval
+                time.sleep(waitInterval)
+                continue
+            if proc.state != curState :
+                self.events.emit ('state', state = proc.state, previous = curState, target = tgtState)
+            curState = proc.state
             if ( curState == tgtState ) :
                 break
             elif ( curState == tgtState.replace('ED', 'ING')) :
                 curTime = datetime.datetime.now()
                 timeHdr = datetime.datetime.strftime (curTime, "%H:%M:%S")
+                (nDone, nHosts) = self.trackHostProgress (tgtState)
                 if self.silent_running == False :
-                    self.logger.info ("%s  : Waiting for %s (current state %s)", timeHdr, tgtState, curState )
+                    eta = self.estimateCompletion (startTime, nDone, nHosts)
+                    if eta == None :
+                        self.logger.info ("%s  : Waiting for %s (current state %s)", timeHdr, tgtState, curState )
+                    else :
+                        self.logger.info ("%s  : Waiting for %s (current state %s; %d of %d hosts done, ETA %ds)", 
+                            timeHdr, tgtState, curState, nDone, nHosts, eta )
                     sys.stdout.flush()
 
                 maxWait -= waitInterval
@@ -532,9 +1955,85 @@ class MIDriver:
             sys.stdout.flush()
 
         self.current_state = curState 
+
+            # Once the phase has left *ING, look at the hosts one last
+            # time : hosts that failed (or finished) on the final poll
+            # would otherwise never be recorded.  Every host's final
+            # state is emitted as a host_state event (final = True).
+        if curState != None  and  curState != tgtState.replace('ED', 'ING')  and  self.deadline.expired() == False :
+            self.trackHostProgress (tgtState, final = True)
+
+        if maxWait <= 0  and  curState != tgtState :
+            self.deadline.check ("waiting for %s (state %s)" % (tgtState, curState))
         return (maxWait > 0) 
 
 
+        # Record the state/status of every host reported by the
+        # installer, noting when each one last changed.  Hosts 
+        # that have not changed in stall_window seconds (and have 
+        # not reached tgtState) are added to self.stalled_hosts
+        # and reported once.  Hosts in an ERROR state are added
+        # to self.failed_hosts as soon as they are seen.  With 
+        # final, the state of every host is emitted whether or not
+        # it changed.
+        #
+        # Returns a tuple of (hosts in tgtState, total hosts)
+    def trackHostProgress (self, tgtState, final=False) :
+        (hosts, changed) = self.poll_hosts()
+        if hosts == None :
+            return (0, 0)
+
+        now = time.time()
+        if changed  or  len(self.host_progress) == 0  or  final == True :
+            for hEntry in hosts :
+                h = hEntry.id
+                hState = hEntry.state
+                hStatus = hEntry.status
+                prev = self.host_progress.get(h)
+                if prev == None  or  prev['state'] != hState  or  prev['status'] != hStatus :
+                    if prev != None :
+                        self.logger.debug ("  host %s : %s (%s)", h, hState, hStatus)
+                    if final == False :
+                        self.events.emit ('host_state', host = h, state = hState, status = hStatus)
+                    self.host_progress[h] = { 'state' : hState, 'status' : hStatus, 'changed' : now }
+                    if h in self.stalled_hosts :
+                        self.stalled_hosts.remove (h)
+                        self.logger.info ("Host (%s) is making progress again", h)
+
+        nDone = 0
+        for h in self.host_progress :
+            hState = self.host_progress[h]['state']
+            hStatus = self.host_progress[h]['status']
+            if hState == tgtState :
+                nDone += 1
+            elif hState != None  and  hState[-5:] == "ERROR" :
+                if h not in self.failed_hosts :
+                    self.failed_hosts.append (h)
+                    self.logger.warn ("Host (%s) failed : %s (%s)", h, hState, hStatus)
+            elif now - self.host_progress[h]['changed'] >= self.stall_window :
+                if h not in self.stalled_hosts :
+                    self.stalled_hosts.append (h)
+                    self.events.emit ('host_stalled', host = h, state = hState, status = hStatus)
+                    self.logger.warn ("Host (%s) has made no progress in %d seconds (state %s, status %s)", 
+                        h, int(now - self.host_progress[h]['changed']), hState, hStatus)
+
+        if final == True :
+            for h in sorted (self.host_progress) :
+                self.events.emit ('host_state', host = h, state = self.host_progress[h]['state'],
+                    status = self.host_progress[h]['status'], final = True)
+
+        return (nDone, len(self.host_progress))
+
+        # Simple linear estimate of the seconds remaining,
+        # based on the rate at which hosts have completed so far.
+        # Returns None until there is enough data to estimate.
+    def estimateCompletion (self, startTime, nDone, nHosts) :
+        if nDone <= 0  or  nHosts <= 0 :
+            return None
+        elapsed = time.time() - startTime
+        return int (elapsed / nDone * (nHosts - nDone))
+
+
         # Check the cluster config.   Optional "hosts" argument
         # is used when adding hosts to an existing cluster, since
         # we don't need to validate the nodes we've already installed.
@@ -548,26 +2047,17 @@ class MIDriver:
             logger.critical ("No disks specified")
             return (False)
 
-            # Handle case were earlier invocation has
-            # left us in INSTALL_ERROR.  There's no need 
-            # for "CHECKING" in that case.
-        if self.current_state != "INSTALL_ERROR" :
-            payload = { 'state' : 'CHECKING' } 
-            self.process_patch (payload)
-            rc = self.waitForProcessState( 'CHECKED' )
-            if rc != True :
-                return (rc)
-
-        payload = { 'state' : 'PROVISIONING' } 
-        self.process_patch (payload)
-        rc = self.waitForProcessState( 'PROVISIONED' )
+        rc = self.provisionCluster()
         if rc != True :
             return (rc)
 
             # If no services are specified, we know
             # we are just running "addNode", which
             # does not require this extra step.
-        if len(self.services) > 0 :
+            # Snapshot clones get their recorded layout instead.
+        if self.snapshot_layout != None :
+            self.applySnapshotLayout()
+        elif len(self.services) > 0 :
             self.updateClusterConfig()
 
             # Print out the cluster's config for sanity 
@@ -577,6 +2067,24 @@ class MIDriver:
 
         return (True)
 
+        # Take the installer through CHECKING and PROVISIONING, 
+        # the steps every configuration change goes through before
+        # INSTALLING.
+    def provisionCluster(self) :
+            # Handle case were earlier invocation has
+            # left us in INSTALL_ERROR.  There's no need 
+            # for "CHECKING" in that case.
+        if self.current_state != "INSTALL_ERROR" :
+            payload = { 'state' : 'CHECKING' } 
+            self.process_patch (payload)
+            rc = self.waitForProcessState( 'CHECKED' )
+            if rc != True :
+                return (rc)
+
+        payload = { 'state' : 'PROVISIONING' } 
+        self.process_patch (payload)
+        return self.waitForProcessState( 'PROVISIONED' )
+
     def doInstall(self) :
         self.logger.debug ("MIDriver::doInstall()")
 
@@ -589,7 +2097,9 @@ class MIDriver:
         else :
             payload = { 'state' : 'INSTALLING' } 
         self.process_patch (payload)
-        rc = self.waitForProcessState( 'INSTALLED' , 5400, 20)
+        rc = self.waitForProcessState( 'INSTALLED' , 5400, 20, max(self.wait_per_host, 60))
+        if rc != True  and  self.current_state == "INSTALL_ERROR" :
+            rc = self.retryFailedHosts()
         if rc != True :
             return (rc)
 
@@ -605,18 +2115,320 @@ class MIDriver:
         self.waitForProcessState( 'COMPLETED' , 10, 10)
         return (True)
 
+        # Hosts carrying quorum services (ZooKeeper, CLDB, 
+        # ResourceManager) cannot be isolated from the cluster.
+    def getQuorumHosts(self) :
+        qHosts = []
+        for svc in self.quorum_services :
+            for h in self.get_service_hosts (svc, self.mapr_version) :
+                if h not in qHosts :
+                    qHosts.append (h)
+        return qHosts
+
+        # The failed subset of hosts may be handled on its own 
+        # if there are few enough of them and none of them is
+        # needed for cluster quorum.
+    def failedHostsIsolatable(self) :
+        if len(self.failed_hosts) == 0 :
+            return False
+        if len(self.failed_hosts) > self.max_failed_hosts :
+            self.logger.info ("%d hosts failed (policy allows %d); not isolating", 
+                len(self.failed_hosts), self.max_failed_hosts)
+            return False
+
+        qHosts = self.getQuorumHosts()
+        for h in self.failed_hosts :
+            if h in qHosts :
+                self.logger.info ("Failed host (%s) carries a quorum service; not isolating", h)
+                return False
+        return True
+
+        # Retry only the hosts that failed in the last INSTALLING
+        # phase.  The installer's RETRYING state re-runs the install
+        # on hosts that are not yet INSTALLED, so the healthy hosts
+        # are left alone.  Each attempt waits longer than the last;
+        # hosts still failing when the budget is exhausted are 
+        # quarantined and the install is retried one final time 
+        # without them.
+    def retryFailedHosts(self) :
+        if self.failedHostsIsolatable() == False :
+            return False
+
+        attempt = 0
+        while attempt < self.host_retry_attempts :
+            backoff = self.host_retry_backoff * (2 ** attempt)
+            attempt += 1
+            self.logger.info ("Retrying %d failed host(s) in %d seconds (attempt %d of %d): %s",
+                len(self.failed_hosts), backoff, attempt, self.host_retry_attempts, ','.join(self.failed_hosts))
+            self.events.emit ('retry', what = "install", attempt = attempt, hosts = list(self.failed_hosts), backoff = backoff)
+            time.sleep (self.deadline.bound (backoff))
+
+            self.process_patch ({ 'state' : 'RETRYING' })
+            rc = self.waitForProcessState( 'INSTALLED' , 5400, 20, max(self.wait_per_host, 60))
+            if rc == True :
+                return (True)
+            if self.current_state != "INSTALL_ERROR"  or  self.failedHostsIsolatable() == False :
+                return (False)
+
+        self.quarantineHosts (list(self.failed_hosts))
+        self.process_patch ({ 'state' : 'RETRYING' })
+        return self.waitForProcessState( 'INSTALLED' , 5400, 20, max(self.wait_per_host, 60))
+
+        # Drop hosts from every group and from the cluster
+        # configuration so that the installer ignores them.
+    def quarantineHosts(self, badHosts) :
+        self.logger.warn ("Quarantining host(s): %s", ','.join(badHosts))
+        self.events.emit ('quarantine', hosts = badHosts)
+        self.removeNodesFromConfig (badHosts)
+        for h in badHosts :
+            if h not in self.quarantined_hosts :
+                self.quarantined_hosts.append (h)
+
+        # Bulk removal: one PATCH per affected group and one
+        # for the cluster host list.
+    def removeNodesFromConfig(self, oldNodes) :
+        self.removeNodesFromGroups (oldNodes)
+
+        (config, changed) = self.poll_get("/api/config")
+        clusterHosts = [ h for h in config['hosts'] if h not in oldNodes ]
+        self.config_patch ({ 'hosts' : clusterHosts })
+
+        self.hosts = [ h for h in self.hosts if h not in oldNodes ]
+
+    def removeNodesFromGroups(self, oldNodes) :
+        for grp in self.iter_groups() :
+            grp_target="/api/groups/"+str(grp['id'])
+            r = self.swagger_get(grp_target)
+            groupHosts = r.json()['hosts']
+            newHosts = [ h for h in groupHosts if h not in oldNodes ]
+            if len(newHosts) != len(groupHosts) :
+                self.swagger_patch (grp_target, {"hosts" : newHosts})
+
+        # Group the cluster hosts into upgrade batches.  Hosts 
+        # carrying quorum services get a batch of their own 
+        # (ZooKeeper hosts first, then CLDB, then ResourceManager) so 
+        # that only one member of each quorum is down at a time.  
+        # The remaining data-only hosts follow in batches of batchSize.
+    def planUpgradeBatches(self, batchSize=None) :
+        if batchSize == None :
+            batchSize = self.upgrade_batch_size
+
+        qHosts = self.getQuorumHosts()
+        batches = [ [h] for h in qHosts if h in self.hosts ]
+        dataHosts = [ h for h in self.hosts if h not in qHosts ]
+        for i in range(0, len(dataHosts), batchSize) :
+            batches.append (dataHosts[i:i+batchSize])
+        return batches
+
+        # Upgrade the cluster to newVersion one batch at a time
+        # (see planUpgradeBatches), verifying each batch before 
+        # moving to the next.  The cluster stays up throughout; 
+        # total time scales with the number of batches rather than
+        # the number of hosts.
+        #
+        # The hosts, services and core version are read from the 
+        # installer's configuration (as addNode does), since this 
+        # driver need not be the one that installed the cluster.
+        #
+        # Returns True when every batch has been upgraded.  On 
+        # failure the remaining batches are left on the old version
+        # and self.current_state reflects the failed batch.  Nothing
+        # is changed if the installer reports no hosts or no core
+        # services.
+    def rollingUpgrade(self, newVersion, batchSize=None) :
+        self.logger.debug ("MIDriver::rollingUpgrade(%s)", newVersion)
+        (config, changed) = self.poll_get("/api/config")
+        if config == None :
+            self.logger.error ("Cannot read installer configuration; upgrade not started")
+            return (False)
+        clusterHosts = list(config.get('hosts', []))
+        clusterServices = {}
+        for svc in config.get('services', {}) :
+            clusterServices[svc] = dict(config['services'][svc])
+        core = clusterServices.get('mapr-core', {})
+        coreServices = [ svc for svc in clusterServices if svc in MAPR_CORE_SERVICES ]
+        if len(clusterHosts) == 0  or  len(coreServices) == 0  or  core.get('version') == None :
+            self.logger.error ("Installer reports no cluster hosts or core services; upgrade not started")
+            return (False)
+
+        self.hosts = clusterHosts
+        self.services = clusterServices
+        self.mapr_version = core['version']
+        oldVersion = self.mapr_version
+        batches = self.planUpgradeBatches (batchSize)
+        self.logger.info ("Upgrading %d hosts from %s to %s in %d batches", 
+            len(self.hosts), oldVersion, newVersion, len(batches))
+
+            # Core services move to the new version; ecosystem 
+            # packages are left as they are.
+        for svc in self.services :
+            if self.services[svc].get('version') == oldVersion :
+                self.services[svc]['version'] = newVersion
+        self.mapr_version = newVersion
+        self.config_patch ({ 'services' : self.services })
+
+        bnum = 0
+        for batch in batches :
+            bnum += 1
+            self.logger.info ("Upgrade batch %d of %d: %s", bnum, len(batches), ','.join(batch))
+            rc = self.upgradeBatch (batch)
+            if rc == True :
+                rc = self.verifyUpgradedHosts (batch)
+            if rc != True :
+                self.logger.error ("Upgrade batch %d failed; %d batches not upgraded", bnum, len(batches) - bnum)
+                return (False)
+
+        return (True)
+
+        # Ask the installer to upgrade just these hosts.  The 
+        # hosts within the batch are upgraded in parallel.
+    def upgradeBatch(self, batch) :
+        payload = { 'state' : 'UPGRADING', 'hosts' : batch }
+        self.process_patch (payload)
+        maxWait = 1800 + max(self.wait_per_host, 60) * len(batch)
+        return self.waitForProcessState( 'UPGRADED' , maxWait, 20, 0)
+
+        # Every host in the batch must report UPGRADED (or, if the
+        # installer reports host versions, the new version) before
+        # we move on to the next batch.
+    def verifyUpgradedHosts(self, batch) :
+        (hosts, changed) = self.poll_hosts()
+        if hosts == None :
+            return (False)
+
+        seen = {}
+        for hEntry in hosts :
+            if hEntry.id in batch :
+                seen[hEntry.id] = hEntry
+
+        rc = True
+        for h in batch :
+            hEntry = seen.get(h)
+            if hEntry == None :
+                self.logger.error ("Host (%s) missing from installer after upgrade", h)
+                rc = False
+            elif hEntry.state == 'UPGRADED' :
+                continue
+            elif hEntry.version != None  and  versionCompare (hEntry.version, self.mapr_version) == 0 :
+                continue
+            else :
+                self.logger.error ("Host (%s) not upgraded : state %s (%s)", h, hEntry.state, hEntry.status)
+                rc = False
+        return (rc)
+
+        # Remove hosts from the cluster (scale-in).
+        #
+        # Hosts carrying quorum services are refused unless 
+        # relocate is set, in which case those services are moved 
+        # to other cluster hosts and installed there first.  The 
+        # hosts are then drained and uninstalled in parallel (at most 
+        # drain_concurrency at a time) and finally dropped from 
+        # all groups and the cluster config in bulk.
+        #
+        # Returns True if every host was removed.  Hosts that fail
+        # to drain are left in the configuration.
+    def removeNodes(self, oldNodes, relocate=False, concurrency=None) :
+        self.logger.debug ("MIDriver::removeNodes(%s)", ','.join(oldNodes))
+        if concurrency == None :
+            concurrency = self.drain_concurrency
+
+        qHosts = [ h for h in self.getQuorumHosts() if h in oldNodes ]
+        if len(qHosts) > 0 :
+            if relocate == False :
+                self.logger.error ("Cannot remove host(s) with quorum services: %s", ','.join(qHosts))
+                return (False)
+            if self.relocateQuorumServices (oldNodes) == False :
+                return (False)
+
+        results = runParallel (self.drainNode, oldNodes, concurrency)
+        removed = [ h for h in oldNodes if results.get(h) == True ]
+        for h in oldNodes :
+            if h not in removed :
+                self.logger.error ("Host (%s) failed to drain : %s", h, results.get(h))
+
+        if len(removed) > 0 :
+            self.removeNodesFromConfig (removed)
+        return ( len(removed) == len(oldNodes) )
+
+        # Move quorum services off oldNodes onto hosts that stay in
+        # the cluster (and don't already run that service), then
+        # install them there before anything is drained.  As for 
+        # any configuration change, the cluster is checked and 
+        # provisioned first (without updateClusterConfig, which 
+        # would redo the service layout).
+        #
+        # Returns False if the services could not be moved or 
+        # installed; nothing should be drained then.
+    def relocateQuorumServices(self, oldNodes) :
+        rc = self.provisionCluster()
+        if rc != True :
+            self.logger.error ("Cannot provision cluster to relocate services (state %s)", self.current_state)
+            return (False)
+
+        for svc in self.quorum_services :
+            svc_target="/api/services/"+"mapr-"+svc+"-"+self.mapr_version
+            r = self.swagger_get (svc_target)
+            if r == None  or  r.status_code != requests.codes.ok :
+                continue
+            svcHosts = list(r.json()['hosts'])
+            moving = [ h for h in svcHosts if h in oldNodes ]
+            if len(moving) == 0 :
+                continue
+
+            spares = [ h for h in self.hosts if h not in oldNodes  and  h not in svcHosts ]
+            if len(spares) < len(moving) :
+                self.logger.error ("Not enough remaining hosts to relocate %s from %s", svc, ','.join(moving))
+                return (False)
+
+            newHosts = [ h for h in svcHosts if h not in oldNodes ] + spares[:len(moving)]
+            self.logger.info ("Relocating %s to %s", svc, ','.join(newHosts))
+            self.swagger_patch (svc_target, {"hosts" : newHosts})
+
+        rc = self.doInstall()
+        if rc != True :
+            self.logger.error ("Install of relocated services failed (state %s)", self.current_state)
+            return (False)
+        return (True)
+
+        # Uninstall MapR from a single host and wait for it to finish
+    def drainNode(self, oldNode) :
+        h_target="/api/hosts/"+oldNode
+        self.swagger_patch (h_target, { 'state' : 'UNINSTALLING' })
+
+        maxWait = self.deadline.bound (self.drain_timeout)
+        waitInterval = 10
+        while maxWait > 0 :
+            r = self.swagger_get ("/api/hosts/?id="+oldNode)
+            if r != None  and  r.status_code == requests.codes.ok :
+                resources = r.json().get('resources', [])
+                hState = None
+                if len(resources) > 0 :
+                    hState = resources[0].get('state')
+                else :
+                    self.logger.debug ("  host %s not listed by installer", oldNode)
+                if hState == 'UNINSTALLED' :
+                    return (True)
+                elif hState != None  and  hState[-5:] == "ERROR" :
+                    return (False)
+            maxWait -= waitInterval
+            time.sleep(waitInterval)
+
+        self.deadline.check ("draining %s" % oldNode)
+        return (False)
+
     def doUninstall(self) :
         self.logger.debug ("MIDriver::doUninstall()")
 
-        r = self.process_get()
-        self.current_state  = r.json()['state']
+        proc = self.get_process()
+        if proc != None :
+            self.current_state  = proc.state
 
 		# TBD ... handle "correct" states a bit better
         if self.current_state != "UNINSTALLING" :
             payload = { 'state' : 'UNINSTALLING' }
             self.process_patch (payload)
 
-        rc = self.waitForProcessState( 'UNINSTALLED' , 5400, 20)
+        rc = self.waitForProcessState( 'UNINSTALLED' , 5400, 20, max(self.wait_per_host, 60))
         if rc != True  and  self.current_state != 'INIT' :
             return (rc)
 
@@ -626,15 +2438,12 @@ class MIDriver:
         # TBD : handle "group doesn't exist" error more completely
     def addNodeToGroup(self, newNode, targetGroup) :
         self.logger.debug ("MIDriver::addNodeToGroup("+newNode+","+targetGroup+")")
-        r = self.groups_get(targetGroup)
-        if r.json()['count'] < 1 :
+        grp = self.get_group(targetGroup, True)
+        if grp == None :
             return (False)
 
-        groupId = r.json()['resources'][0]['id']
-        grp_target="/api/groups/"+str(groupId)
-
-        r = self.swagger_get(grp_target)
-        groupHosts = r.json()['hosts']
+        grp_target="/api/groups/"+str(grp.id)
+        groupHosts = grp.hosts
         self.logger.debug ("   "+targetGroup+" hosts: " + ','.join(groupHosts))
 
         if newNode in groupHosts :
@@ -656,8 +2465,8 @@ class MIDriver:
         if (newNode == None) :
             return (False)
 
-        r = self.config_get()
-        clusterHosts = r.json()['hosts']
+        (config, changed) = self.poll_get("/api/config")
+        clusterHosts = list(config['hosts'])
         self.logger.debug ("   current hosts: " + ','.join(clusterHosts))
 
         if newNode in clusterHosts :
@@ -681,7 +2490,7 @@ class MIDriver:
                 #   TBD: should probably add a "Retrieve Current Config"
                 #   option so that we can manage this better.
         self.hosts = list(clusterHosts)
-        self.disks = list(r.json()['disks'])
+        self.disks = list(config['disks'])
         self.checkClusterConfig(list(newNode))
 
         self.addNodeToGroup (newNode, targetGroup)
@@ -690,6 +2499,237 @@ class MIDriver:
             
         self.doInstall()
 
+        # Host name <-> MAPRNODE<n> token translation for snapshots
+    def snapshotTokens(self, hostList, clusterHosts) :
+        tokens = []
+        for h in hostList :
+            if h in clusterHosts :
+                tokens.append (SNAPSHOT_NODE_PREFIX + str(clusterHosts.index(h)))
+            else :
+                tokens.append (h)
+        return tokens
+
+    def snapshotHosts(self, tokenList) :
+        hostList = []
+        for t in tokenList :
+            if t.startswith (SNAPSHOT_NODE_PREFIX) :
+                idx = int (t[len(SNAPSHOT_NODE_PREFIX):])
+                if idx >= len(self.hosts) :
+                    raise ValueError ("snapshot references %s but only %d hosts were given" % (t, len(self.hosts)))
+                hostList.append (self.hosts[idx])
+            else :
+                hostList.append (t)
+        return hostList
+
+        # Write the installer's current configuration, services map,
+        # group memberships and service host assignments to fileName
+        # as JSON (see SNAPSHOT_VERSION for the format version).
+    def exportSnapshot(self, fileName) :
+        self.logger.debug ("MIDriver::exportSnapshot(%s)", fileName)
+        r = self.config_get()
+        config = r.json()
+        clusterHosts = list(config.get('hosts', []))
+
+            # The installer's core version, not this driver's (which 
+            # is only the default unless it installed the cluster)
+        mapr_version = config.get('services', {}).get('mapr-core', {}).get('version', self.mapr_version)
+
+        snapshot = { 'snapshot_version' : SNAPSHOT_VERSION,
+            'created' : datetime.datetime.utcnow().strftime ("%Y-%m-%dT%H:%M:%SZ"),
+            'mapr_version' : mapr_version,
+            'host_count' : len(clusterHosts),
+            'config' : {},
+            'services' : config.get('services', {}),
+            'groups' : [],
+            'service_hosts' : {} }
+
+        for key in config :
+            if key not in SNAPSHOT_EXCLUDED_CONFIG :
+                snapshot['config'][key] = config[key]
+
+        for grp in self.iter_groups() :
+            grpHosts = grp.get('hosts')
+            if grpHosts == None :
+                grpHosts = self.swagger_get ("/api/groups/"+str(grp['id'])).json()['hosts']
+            snapshot['groups'].append ({ 'label' : grp['label'], 'hosts' : self.snapshotTokens (grpHosts, clusterHosts) })
+
+        for svc in self.iter_services() :
+            if len(svc.get('hosts', [])) > 0 :
+                svcId = svc['name'] + "-" + svc['version']
+                snapshot['service_hosts'][svcId] = self.snapshotTokens (svc['hosts'], clusterHosts)
+
+        with open (fileName, "w") as snapFile :
+            json.dump (snapshot, snapFile, indent=4, sort_keys=True)
+        self.logger.info ("Cluster snapshot (%d hosts, %d groups, %d services) written to %s", 
+            len(clusterHosts), len(snapshot['groups']), len(snapshot['service_hosts']), fileName)
+
+        # Load a snapshot and upload its configuration to a fresh 
+        # installer in a single PATCH, using self.hosts (in MAPRNODE 
+        # order) and this driver's credentials.  The group and service 
+        # layout is held in self.snapshot_layout and applied by 
+        # checkClusterConfig once the installer has PROVISIONED, in 
+        # place of the automatic corrections in updateClusterConfig.
+        #
+        # Returns the same result as initializeClusterConfig.
+    def applySnapshot(self, fileName) :
+        self.logger.debug ("MIDriver::applySnapshot(%s)", fileName)
+        with open (fileName, "r") as snapFile :
+            snapshot = json.load (snapFile)
+
+        if snapshot.get('snapshot_version') != SNAPSHOT_VERSION :
+            self.logger.error ("Unsupported snapshot version %s in %s", snapshot.get('snapshot_version'), fileName)
+            return (False)
+        if len(self.hosts) < snapshot['host_count'] :
+            self.logger.error ("Snapshot %s needs %d hosts; only %d given", fileName, snapshot['host_count'], len(self.hosts))
+            return (False)
+
+        self.mapr_version = snapshot['mapr_version']
+        self.services = snapshot['services']
+        if self.configurePackageMirror() == False :
+            return (False)
+        if len(self.disks) == 0 :
+            self.disks = list(snapshot['config'].get('disks', []))
+
+        payload = dict(snapshot['config'])
+        payload['hosts'] = self.hosts
+        payload['disks'] = self.disks
+        payload['services'] = self.services
+        payload['cluster_admin_password'] = self.mapr_password
+        payload['ssh_id'] = self.ssh_user
+        if self.ssh_key != None :
+            payload['ssh_key'] = self.ssh_key
+        elif self.ssh_password != None :
+            payload['ssh_password'] = self.ssh_password
+        if self.cluster != 'my.cluster.com' :
+            payload['cluster_name'] = self.cluster
+        self.config_patch (payload)
+
+        self.configureTrialLicense()
+
+        self.snapshot_layout = { 'groups' : [], 'service_hosts' : {} }
+        for grp in snapshot['groups'] :
+            self.snapshot_layout['groups'].append ({ 'label' : grp['label'], 'hosts' : self.snapshotHosts (grp['hosts']) })
+        for svcId in snapshot['service_hosts'] :
+            self.snapshot_layout['service_hosts'][svcId] = self.snapshotHosts (snapshot['service_hosts'][svcId])
+
+        rc = self.waitForProcessState( 'INIT' )
+        if rc == False  and  self.current_state != None :
+            if self.current_state[0:5] == "CHECK" :
+                rc = True
+            elif self.current_state == "PROVISIONED" :
+                rc = True
+        return rc
+
+        # One PATCH per group and per assigned service
+    def applySnapshotLayout(self) :
+        self.logger.debug ("MIDriver::applySnapshotLayout()")
+        for grp in self.snapshot_layout['groups'] :
+            installerGrp = self.get_group (grp['label'])
+            if installerGrp == None :
+                self.logger.warn ("Snapshot group %s not found in installer", grp['label'])
+                continue
+            self.swagger_patch ("/api/groups/"+str(installerGrp.id), {"hosts" : grp['hosts']})
+
+        for svcId in self.snapshot_layout['service_hosts'] :
+            self.swagger_patch ("/api/services/"+svcId, {"hosts" : self.snapshot_layout['service_hosts'][svcId]})
+
+        # Probe one "host:port" endpoint : TCP connect, then
+        # (optionally) an HTTP(S) GET.  Any HTTP response below 500
+        # counts as up; the MCS and installer ports speak https.
+    def probeEndpoint(self, endpoint, httpCheck=False) :
+        (host, port) = endpoint.rsplit(':', 1)
+        result = { 'endpoint' : endpoint, 'tcp' : False, 'http' : None }
+        try :
+            sock = socket.create_connection ((host, int(port)), self.probe_timeout)
+            sock.close()
+            result['tcp'] = True
+        except (socket.error, socket.timeout) :
+            return result
+
+        if httpCheck == True :
+            scheme = "https" if port in [ '8443', '9443' ] else "http"
+            try :
+                r = requests.get (scheme+"://"+endpoint+"/", verify = False, 
+                    timeout = self.probe_timeout, allow_redirects = False)
+                result['http'] = r.status_code
+            except requests.RequestException :
+                result['http'] = 0
+        return result
+
+        # Probe the ui ports of every configured service on every
+        # host, all at once (probe_concurrency at a time, each 
+        # bounded by probe_timeout), and log a health matrix.
+        # Endpoints that are down are probed again until they
+        # respond or verify_grace (bounded by the deadline) runs
+        # out.  Services without ui ports are not probed.
+        #
+        # Returns True unless a service in required has an
+        # endpoint that is down.
+    def verifyServices(self, required=[ 'webserver' ], httpCheck=False) :
+        self.logger.debug ("MIDriver::verifyServices()")
+        endpoints = {}
+        for svc in sorted(self.services) :
+            sname = svc.replace ("mapr-", "", 1)
+            entry = self.get_service (sname, self.services[svc].get('version'))
+            if entry == None  or  len(entry.ui_ports) == 0 :
+                continue
+            endpoints[sname] = [ h+':'+str(p) for h in entry.hosts for p in entry.ui_ports ]
+
+        def isUp(res) :
+            if not isinstance (res, dict) :
+                return False
+            return res['tcp']  and  ( res['http'] == None  or  0 < res['http'] < 500 )
+
+        allEndpoints = [ e for sname in endpoints for e in endpoints[sname] ]
+        results = runParallel (lambda e: self.probeEndpoint (e, httpCheck), allEndpoints, self.probe_concurrency)
+
+        graceEnd = time.time() + self.deadline.bound (self.verify_grace)
+        down = [ e for e in allEndpoints if not isUp (results.get(e)) ]
+        while len(down) > 0  and  time.time() + self.verify_interval < graceEnd :
+            self.logger.info ("%d service endpoint(s) not responding yet; retrying in %d seconds",
+                len(down), self.verify_interval)
+            sys.stdout.flush()
+            time.sleep (self.verify_interval)
+            results.update (runParallel (lambda e: self.probeEndpoint (e, httpCheck), down, self.probe_concurrency))
+            down = [ e for e in down if not isUp (results.get(e)) ]
+
+        rc = True
+        self.logger.info ("")
+        self.logger.info ("Service Health: ")
+        self.logger.info ("%-20s %-40s %-6s %-6s", "SERVICE", "ENDPOINT", "TCP", "HTTP")
+        for sname in sorted(endpoints) :
+            for e in endpoints[sname] :
+                res = results.get(e)
+                if not isinstance (res, dict) :
+                    res = { 'tcp' : False, 'http' : None }
+                up = isUp (res)
+                self.logger.info ("%-20s %-40s %-6s %-6s", sname, e, 
+                    res['tcp'] and "up" or "DOWN", res['http'] != None and str(res['http']) or "-")
+                if not up  and  sname in required :
+                    rc = False
+
+        for sname in required :
+            if sname not in endpoints :
+                self.logger.warn ("Required service %s has no endpoints to verify", sname)
+        self.logger.info ("")
+        sys.stdout.flush()
+        return (rc)
+
+        # Run a reporting step (eg, printProcessStatus after a 
+        # failure) regardless of the deadline, allowing it 
+        # report_grace seconds of its own.  Errors are logged, not
+        # raised; returns None if func did not complete.
+    def bestEffort(self, func, *args) :
+        saved = self.deadline
+        self.deadline = MIDeadline (self.report_grace)
+        try :
+            return func (*args)
+        except (MIDeadlineExceeded, requests.RequestException) as e :
+            self.logger.warn ("%s did not complete (%s)", getattr (func, '__name__', "report"), e)
+            return None
+        finally :
+            self.deadline = saved
+
     def printCoreServiceLayout(self, svc_list=["zookeeper","cldb","fileserver","nodemanager","resourcemanager" ]) :
         self.logger.info ("")
         self.logger.info ("Cluster Services Configuration: ")
@@ -711,19 +2751,21 @@ class MIDriver:
         # (that have the SAME status as the overall version
         # or an ERROR state)
     def printProcessStatus(self) :
-        r = self.process_get ()
-        if r.status_code == requests.codes.ok :
-            curStatus = r.json()['status']
+        proc = self.get_process()
+        if proc != None :
+            curStatus = proc.status
             self.logger.info ("Installer status : "+curStatus)
         else :
             return
 
-        for h in self.hosts :
-            h_target="/api/hosts/?id="+h
-            r = self.swagger_get (h_target)
-            if r.status_code == requests.codes.ok :
-                hState = r.json()['resources'][0]['state']
-                hStatus = r.json()['resources'][0]['status']
+        (hosts, changed) = self.poll_hosts()
+        if hosts != None :
+            for hEntry in hosts :
+                h = hEntry.id
+                if h not in self.hosts :
+                    continue
+                hState = hEntry.state
+                hStatus = hEntry.status
                 if hState == self.current_state :
                     self.logger.info ("Host ("+h+") status : "+hStatus)
                 elif hState[-5:] == "ERROR" :
@@ -732,12 +2774,29 @@ class MIDriver:
         self.logger.info ("Check "+self.installer_url+"/api/process/log for additional details")
 
         # TBD : be smarter about formatting the log ... it's raw text
-        # and often VERY confusing
+        # and often VERY confusing (see MILogAnalyzer for a summary)
     def printProcessLog(self) :
         r = self.swagger_get ("/api/process/log")
         if r.status_code == requests.codes.ok :
             self.logger.info ("Process Log:"+r.text)
 
+        # Generator over the lines of the process log, streamed 
+        # rather than read into memory (for MILogAnalyzer)
+    def iter_process_log(self) :
+            # The scheduler slot is held only until the headers arrive
+        r = self.installer_request ("GET", "/api/process/log", stream = True)
+        if r.status_code != requests.codes.ok :
+            self.logger.warn ("MIDriver::iter_process_log returned bad status %d", r.status_code)
+            return
+        received = 0
+        for line in r.iter_lines() :
+            received += len(line) + 1
+            yield line
+        r.close()
+        self.wire_stats['responses'] += 1
+        self.wire_stats['recv_body'] += received
+        self.wire_stats['recv_wire'] += int(r.headers.get('Content-Length', received))
+
     def printSuccessUrl(self) :
         self.logger.info ("MapR Installer Service available at "+self.installer_url+"/#/complete") 
         sys.stdout.flush()
@@ -0,0 +1,314 @@
+# MapR Installer Node Executor (MIExecutor)
+#
+# Run a command or script on every cluster node in parallel.
+#
+# Usage :
+#   As a module (see deploy-mapr-cluster.py --preflight-command) :
+#       executor = MIExecutor (SshTransport ('azureuser', keyfile))
+#       results = executor.run (readHostsFile(), "sudo sh prepare-node.sh")
+#       badHosts = [ r['host'] for r in results if not r['ok'] ]
+#
+#   or from the command line :
+#       MIExecutor.py --ssh-user azureuser --ssh-keyfile ~/.ssh/id_rsa \
+#           --script prepare-disks.sh
+#
+# Overview :
+#   The installer-wrapper.sh model of preparing nodes is a
+#   serial loop of ssh invocations with bash-level wait/retry
+#   logic.   This class runs the same work across all hosts at
+#   once, with
+#       - at most "fanout" hosts in progress at any time
+#       - a timeout for each host, enforced on the remote side 
+#         with coreutils "timeout" (killing the local ssh client
+#         alone would leave the remote command running)
+#       - a number of retries per host
+#       - optionally, an overall deadline (any object with a 
+#         remaining() method giving seconds left, or None for no
+#         limit, eg MIDriver.MIDeadline) : attempts are cut down
+#         to what is left of it, and none are started once it 
+#         has run out
+#   Each line of output is logged with the host name prefixed,
+#   and run() returns one result entry per host so that callers
+#   can exclude the hosts that failed.
+#
+#   The remote transport is pluggable : SshTransport runs the
+#   command via ssh, LocalTransport runs it locally (useful for
+#   exercising the executor without any remote systems).
+#
+
+import os
+import sys
+import subprocess
+import argparse
+import threading
+import time
+import math
+try :
+    from shlex import quote
+except ImportError :
+    from pipes import quote
+
+import logging
+
+__author__ = "MapR"
+
+
+    # Grace period (seconds) between the remote "timeout" and the
+    # local kill of the transport process, so that the remote exit
+    # status (124 on timeout) normally comes back.
+KILL_GRACE = 15
+TIMEOUT_RC = 124
+
+    # Hosts file generated by gen-cluster-hosts.sh
+    #   (lines of the form "<hostname> MAPRNODE<n>")
+CF_HOSTS_FILE = "/tmp/maprhosts"
+
+def readHostsFile(hostsFile=CF_HOSTS_FILE) :
+    hosts = []
+    if not os.path.isfile(hostsFile) :
+        return hosts
+
+    with open (hostsFile, "r") as hf :
+        for line in hf :
+            fields = line.split()
+            if len(fields) > 0 :
+                hosts.append (fields[0])
+    return hosts
+
+
+    # A transport turns (host, command, script) into the argument
+    # list for subprocess.  If script is given, its contents are
+    # passed on stdin to the interpreter ("bash -s" by default, or 
+    # eg "python -") with command as the arguments.  If timeout is
+    # given, the command is run under "timeout" on the target so
+    # that it is killed there (TERM, then KILL 10 seconds later).
+def timeoutPrefix(timeout) :
+    if timeout == None :
+        return []
+    return [ "timeout", "-k", "10", str(max(1, int(math.ceil(timeout)))) ]
+
+class LocalTransport:
+    def command(self, host, command, script=None, interpreter="bash -s", timeout=None) :
+        if script != None :
+            return timeoutPrefix(timeout) + interpreter.split() + command.split()
+        return timeoutPrefix(timeout) + [ "/bin/bash", "-c", command ]
+
+class SshTransport:
+    def __init__(self, user, keyfile=None, password=None, connectTimeout=10) :
+        self.user = user
+        self.keyfile = keyfile
+        self.password = password
+        self.ssh_opts = [ "-o", "StrictHostKeyChecking=no",
+            "-o", "UserKnownHostsFile=/dev/null",
+            "-o", "ConnectTimeout=" + str(connectTimeout) ]
+
+    def command(self, host, command, script=None, interpreter="bash -s", timeout=None) :
+        cmd = []
+        opts = list(self.ssh_opts)
+        if self.keyfile != None :
+            opts += [ "-i", self.keyfile, "-o", "BatchMode=yes" ]
+        elif self.password != None :
+            cmd = [ "/usr/bin/sshpass", "-e" ]
+            opts += [ "-o", "PasswordAuthentication=yes" ]
+
+        if script != None :
+            remote = interpreter + " " + command
+        else :
+            remote = "/bin/bash -c " + quote (command)
+        remote = " ".join (timeoutPrefix(timeout) + [ remote ])
+        return cmd + [ "ssh" ] + opts + [ self.user + "@" + host, remote ]
+
+    def environment(self) :
+        if self.keyfile == None  and  self.password != None :
+            env = dict(os.environ)
+            env['SSHPASS'] = self.password
+            return env
+        return None
+
+
+class MIExecutor:
+    def __init__(self, transport=None, fanout=16, timeout=600, retries=2, retryDelay=10, deadline=None) :
+        if transport == None :
+            transport = LocalTransport()
+        self.transport = transport
+        self.fanout = fanout
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retryDelay
+        self.deadline = deadline
+        self.output_lock = threading.Lock()
+
+            # And our logger (use global default logger for now)
+        self.logger = logging.getLogger()
+
+        # Run command (or script, with command as its arguments)
+        # on every host.  command may also be a function of the 
+        # host returning the command for that host.  Returns a list
+        # of result entries, in the order of hosts :
+        #   { 'host', 'ok', 'rc', 'attempts', 'elapsed', 'timed_out', 'output' }
+        # 'output' holds the last few lines from the final attempt.
+    def run(self, hosts, command, script=None, interpreter="bash -s") :
+        scriptText = None
+        if script != None :
+            with open (script, "r") as sf :
+                scriptText = sf.read()
+
+        results = {}
+        pending = list(hosts)
+        lock = threading.Lock()
+
+        def worker() :
+            while True :
+                with lock :
+                    if len(pending) == 0 :
+                        return
+                    h = pending.pop(0)
+                hostCommand = command
+                if callable (command) :
+                    hostCommand = command (h)
+                res = self.runHost (h, hostCommand, scriptText, interpreter)
+                with lock :
+                    results[h] = res
+
+        workers = [ threading.Thread(target=worker) for i in range(max(1, min(self.fanout, len(pending)))) ]
+        for w in workers :
+            w.daemon = True
+            w.start()
+        for w in workers :
+            w.join()
+
+        return [ results[h] for h in hosts ]
+
+        # Seconds left of the deadline (None if there is none)
+    def remaining(self) :
+        if self.deadline == None :
+            return None
+        return self.deadline.remaining()
+
+        # Run on one host, retrying failed attempts while the 
+        # deadline allows
+    def runHost(self, host, command, scriptText=None, interpreter="bash -s") :
+        startTime = time.time()
+        attempt = 0
+        (rc, timedOut, output) = (None, True, [ "deadline exceeded" ])
+        while True :
+            left = self.remaining()
+            if left != None  and  left <= 0 :
+                self.logger.warn ("%s: deadline exceeded; not running", host)
+                break
+            attempt += 1
+            timeout = self.timeout
+            if left != None :
+                timeout = min (timeout, left)
+            (rc, timedOut, output) = self.runOnce (host, command, scriptText, interpreter, timeout)
+            if rc == 0  or  attempt > self.retries :
+                break
+            left = self.remaining()
+            if left != None  and  left <= self.retry_delay :
+                self.logger.warn ("%s: attempt %d failed (rc %s); deadline too close to retry", host, attempt, rc)
+                break
+            self.logger.info ("%s: attempt %d failed (rc %s%s); retrying in %d seconds",
+                host, attempt, rc, timedOut and ", timed out" or "", self.retry_delay)
+            time.sleep (self.retry_delay)
+
+        return { 'host' : host, 'ok' : (rc == 0), 'rc' : rc, 'attempts' : attempt,
+            'elapsed' : round(time.time() - startTime, 1), 'timed_out' : timedOut,
+            'output' : output }
+
+    def runOnce(self, host, command, scriptText=None, interpreter="bash -s", timeout=None) :
+        if timeout == None :
+            timeout = self.timeout
+        argv = self.transport.command (host, command, scriptText, interpreter, timeout)
+        env = None
+        if hasattr (self.transport, 'environment') :
+            env = self.transport.environment()
+
+        try :
+            proc = subprocess.Popen (argv, env=env,
+                stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        except OSError as e :
+            self.logger.error ("%s: %s", host, e)
+            return (None, False, [ str(e) ])
+
+            # The command itself runs under "timeout" on the host.
+            # As a backstop (eg, an unreachable host), a timer kills
+            # the local process a little later; Python 2 has no 
+            # Popen timeout.
+        expired = []
+        def expire() :
+            expired.append (True)
+            try :
+                proc.kill()
+            except OSError :
+                pass
+        timer = threading.Timer (timeout + KILL_GRACE, expire)
+        timer.start()
+
+        if scriptText != None :
+            try :
+                proc.stdin.write (scriptText.encode('utf-8'))
+            except IOError :
+                pass
+        proc.stdin.close()
+
+        tail = []
+        for line in iter (proc.stdout.readline, b'') :
+            line = line.decode('utf-8', 'replace').rstrip()
+            with self.output_lock :
+                self.logger.info ("%s: %s", host, line)
+            tail = (tail + [ line ])[-10:]
+        rc = proc.wait()
+        timer.cancel()
+
+        return (rc, len(expired) > 0  or  rc == TIMEOUT_RC, tail)
+
+        # Simple table of results for the log
+    def printResults(self, results) :
+        self.logger.info ("%-30s %-6s %-5s %-8s %-8s", "HOST", "OK", "RC", "TRIES", "SECONDS")
+        for r in results :
+            self.logger.info ("%-30s %-6s %-5s %-8d %-8.1f", r['host'],
+                r['ok'] and "yes" or (r['timed_out'] and "TIMEOUT" or "no"), r['rc'], r['attempts'], r['elapsed'])
+
+
+def gatherArgs () :
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--hosts-file", default=CF_HOSTS_FILE,
+        help="File containing hosts (one host per line)")
+    parser.add_argument("--ssh-user",
+        help="ssh user for system access (run locally if not given)")
+    parser.add_argument("--ssh-keyfile",
+        help="ssh private key file")
+    parser.add_argument("--ssh-password",
+        help="password for ssh user (if no key file is given)")
+    parser.add_argument("--fanout", type=int, default=16,
+        help="Maximum number of hosts to run on at once")
+    parser.add_argument("--timeout", type=int, default=600,
+        help="Seconds allowed for each host")
+    parser.add_argument("--retries", type=int, default=2,
+        help="Retries for each failed host")
+    parser.add_argument("--script",
+        help="Local script to run on each host (command is passed as its arguments)")
+    parser.add_argument("command", nargs='?', default="",
+        help="Command to run on each host")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+    logging.basicConfig (level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    args = gatherArgs()
+
+    if args.ssh_user != None :
+        transport = SshTransport (args.ssh_user, args.ssh_keyfile, args.ssh_password)
+    else :
+        transport = LocalTransport()
+
+    executor = MIExecutor (transport, args.fanout, args.timeout, args.retries)
+    results = executor.run (readHostsFile(args.hosts_file), args.command, args.script)
+    executor.printResults (results)
+
+    failed = [ r['host'] for r in results if not r['ok'] ]
+    if len(failed) > 0 :
+        sys.exit (1)
+    sys.exit (0)
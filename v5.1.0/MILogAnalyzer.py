@@ -0,0 +1,242 @@
+# MapR Installer Process Log Analyzer (MILogAnalyzer)
+#
+# Turn the installer's process log (/api/process/log) into
+# per-host, per-task timings.
+#
+# Usage :
+#   As a module (see deploy-mapr-cluster.py --analyze-log) :
+#       analyzer = MILogAnalyzer ()
+#       analyzer.consume (driver.iter_process_log())
+#       analyzer.printReport ()
+#
+#   or against a saved log :
+#       MILogAnalyzer.py /opt/mapr/installer/logs/installer-process.log
+#
+# Overview :
+#   The installer drives the nodes with ansible, so the log is a
+#   series of task headers
+#       2016-03-21 18:02:11,412 TASK: [mapr-core | install packages] ****
+#   each followed by one result line per host as that host finishes
+#       2016-03-21 18:04:39,027 changed: [node3]
+#   Lines are parsed one at a time (the log is never held in
+#   memory), into task-start and host-result events.  A host's
+#   time for a task is from the task header to its result line;
+#   the task's wall time is from its header to the next header.
+#
+#   Lines without a leading timestamp still count results, but
+#   cannot be timed.
+#
+#   The report gives
+#       - the host x task duration table
+#       - the slowest tasks (by wall time)
+#       - outlier hosts (total time well above the median host)
+#       - the critical path : for each task in order, the host
+#         that held it up and for how long
+#
+
+import sys
+import re
+import datetime
+import argparse
+
+import logging
+
+__author__ = "MapR"
+
+
+TIMESTAMP_RE = re.compile (r'^\s*(\d{4}-\d\d-\d\d[ T]\d\d:\d\d:\d\d)(?:[.,](\d+))?\s*')
+TASK_RE = re.compile (r'^(?:TASK|HANDLER)\s*:?\s*\[(.*?)\]')
+RESULT_RE = re.compile (r'^(ok|changed|failed|fatal|skipping|unreachable)\s*:\s*\[([^\]]+)\]')
+PLAY_RE = re.compile (r'^PLAY\s*\[(.*?)\]')
+
+
+def parseTimestamp(stamp, fraction) :
+    ts = datetime.datetime.strptime (stamp.replace('T', ' '), "%Y-%m-%d %H:%M:%S")
+    if fraction != None :
+        ts += datetime.timedelta (seconds = float("0." + fraction))
+    return ts
+
+    # Generator of events from an iterable of log lines :
+    #   ( 'play', timestamp, name )
+    #   ( 'task', timestamp, name )
+    #   ( 'result', timestamp, host, status )
+    # timestamp is None for lines without one.
+def parseEvents(lines) :
+    for line in lines :
+        if isinstance (line, bytes) :
+            line = line.decode ('utf-8', 'replace')
+        ts = None
+        m = TIMESTAMP_RE.match (line)
+        if m != None :
+            ts = parseTimestamp (m.group(1), m.group(2))
+            line = line[m.end():]
+        line = line.strip()
+
+        m = TASK_RE.match (line)
+        if m != None :
+            yield ( 'task', ts, m.group(1).strip() )
+            continue
+        m = RESULT_RE.match (line)
+        if m != None :
+            yield ( 'result', ts, m.group(2).strip(), m.group(1) )
+            continue
+        m = PLAY_RE.match (line)
+        if m != None :
+            yield ( 'play', ts, m.group(1).strip() )
+
+
+def median(values) :
+    values = sorted (values)
+    if len(values) == 0 :
+        return 0
+    mid = len(values) // 2
+    if len(values) % 2 == 1 :
+        return values[mid]
+    return (values[mid-1] + values[mid]) / 2.0
+
+
+class MILogAnalyzer:
+    def __init__(self) :
+            # tasks in log order : { 'name', 'start', 'end', 'hosts' : { host : (seconds, status) } }
+        self.tasks = []
+        self.hosts = []
+        self.failures = []
+
+            # And our logger (use global default logger for now)
+        self.logger = logging.getLogger()
+
+    def consume(self, lines) :
+        current = None
+        for ev in parseEvents (lines) :
+            if ev[0] in [ 'task', 'play' ] :
+                if current != None  and  current['end'] == None :
+                    current['end'] = ev[1]
+                if ev[0] == 'play' :
+                    current = None
+                    continue
+                current = { 'name' : ev[2], 'start' : ev[1], 'end' : None, 'hosts' : {} }
+                self.tasks.append (current)
+            elif ev[0] == 'result'  and  current != None :
+                host = ev[2]
+                status = ev[3]
+                if host not in self.hosts :
+                    self.hosts.append (host)
+                secs = None
+                if ev[1] != None  and  current['start'] != None :
+                    secs = (ev[1] - current['start']).total_seconds()
+                    if current.get('last_result') == None  or  ev[1] > current['last_result'] :
+                        current['last_result'] = ev[1]
+                current['hosts'][host] = ( secs, status )
+                if status in [ 'failed', 'fatal', 'unreachable' ] :
+                    self.failures.append ( (current['name'], host, status) )
+
+            # The last task ends with its last result
+        if current != None  and  current['end'] == None :
+            current['end'] = current.get('last_result')
+
+    def taskWallTime(self, task) :
+        if task['start'] == None  or  task['end'] == None :
+            return None
+        return (task['end'] - task['start']).total_seconds()
+
+    def hostTotals(self) :
+        totals = {}
+        for h in self.hosts :
+            totals[h] = sum ([ t['hosts'][h][0] for t in self.tasks
+                if h in t['hosts']  and  t['hosts'][h][0] != None ])
+        return totals
+
+    def slowestTasks(self, count=10) :
+        timed = [ (self.taskWallTime(t), t['name']) for t in self.tasks if self.taskWallTime(t) != None ]
+        timed.sort (reverse=True)
+        return timed[:count]
+
+        # Hosts whose total time is more than factor x the median
+    def outlierHosts(self, factor=1.5) :
+        totals = self.hostTotals()
+        med = median (list(totals.values()))
+        return [ (h, totals[h]) for h in self.hosts if med > 0  and  totals[h] > factor * med ]
+
+        # For each task, the host whose result came last
+        # (with its time) -- the path that set the install time.
+    def criticalPath(self) :
+        path = []
+        for t in self.tasks :
+            timed = [ (t['hosts'][h][0], h) for h in t['hosts'] if t['hosts'][h][0] != None ]
+            if len(timed) == 0 :
+                continue
+            (secs, host) = max (timed)
+            path.append ( (t['name'], host, secs) )
+        return path
+
+    def printReport(self, slowest=10, hostTable=True) :
+        log = self.logger
+        log.info ("")
+        log.info ("Install log analysis: %d tasks, %d hosts, %d failures", len(self.tasks), len(self.hosts), len(self.failures))
+
+        if hostTable == True  and  len(self.hosts) > 0 :
+            log.info ("")
+            log.info ("Per-host task durations (seconds):")
+            log.info ("%-50s %s", "TASK", " ".join([ "%12s" % h[-12:] for h in self.hosts ]))
+            for t in self.tasks :
+                cells = []
+                for h in self.hosts :
+                    entry = t['hosts'].get(h)
+                    if entry == None :
+                        cells.append ("%12s" % "-")
+                    elif entry[0] == None :
+                        cells.append ("%12s" % entry[1])
+                    else :
+                        cells.append ("%12.1f" % entry[0])
+                log.info ("%-50s %s", t['name'][:50], " ".join(cells))
+
+        log.info ("")
+        log.info ("Slowest tasks:")
+        for (secs, name) in self.slowestTasks (slowest) :
+            log.info ("  %8.1fs  %s", secs, name)
+
+        totals = self.hostTotals()
+        log.info ("")
+        log.info ("Host totals (median %.1fs):", median (list(totals.values())))
+        outliers = dict (self.outlierHosts())
+        for h in sorted (self.hosts, key=lambda h: totals[h], reverse=True) :
+            log.info ("  %8.1fs  %s%s", totals[h], h, h in outliers and "   <== outlier" or "")
+
+        path = self.criticalPath()
+        log.info ("")
+        log.info ("Critical path (%.1fs):", sum ([ p[2] for p in path ]))
+        for (name, host, secs) in path :
+            log.info ("  %8.1fs  %-50s %s", secs, name[:50], host)
+
+        if len(self.failures) > 0 :
+            log.info ("")
+            log.info ("Failures:")
+            for (name, host, status) in self.failures :
+                log.info ("  %-10s %-30s %s", status, host, name)
+        log.info ("")
+
+
+def gatherArgs () :
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--slowest", type=int, default=10,
+        help="Number of slowest tasks to list")
+    parser.add_argument("--no-host-table", default=False, action="store_true",
+        help="Skip the host x task duration table")
+    parser.add_argument("logfile", nargs='?',
+        help="Saved installer process log (stdin if not given)")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+    logging.basicConfig (level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    args = gatherArgs()
+
+    analyzer = MILogAnalyzer()
+    if args.logfile != None :
+        with open (args.logfile, "r") as lf :
+            analyzer.consume (lf)
+    else :
+        analyzer.consume (sys.stdin)
+    analyzer.printReport (args.slowest, not args.no_host_table)
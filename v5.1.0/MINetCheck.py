@@ -0,0 +1,267 @@
+# MapR Cluster Network Check (MINetCheck)
+#
+# Lightweight inter-node bandwidth/latency test, using nothing
+# more than python sockets.
+#
+# Usage :
+#   As a module (see deploy-mapr-cluster.py --network-check) :
+#       slowHosts = checkNetwork (hosts, SshTransport (...), minMbps=500)
+#
+#   From the command line, the same module runs either end of a test :
+#       MINetCheck.py --serve --port 47001 --timeout 60
+#       MINetCheck.py --connect <host> --port 47001 --seconds 5
+#   or a loopback self-test of the whole check :
+#       MINetCheck.py --loopback 3
+#
+# Overview :
+#   Hosts are shuffled into a ring and each host is paired with
+#   its successor, so every host is tested once as a sender and
+#   once as a receiver (at most maxPairs pairs).   For each pair
+#   a receiver is started on one host and a client on the other
+#   (via MIExecutor, so this module is simply piped to "python -"
+#   on the remote systems).   The client measures round-trip
+#   latency with 1-byte pings, then streams data for a few
+#   seconds; the receiver reports how many bytes it got and over
+#   what time.
+#
+#   A host is flagged when every pair it took part in fell below
+#   minMbps or above maxLatencyMs.   A single bad pair flags both
+#   of its hosts only if neither took part in a good pair.
+#
+
+import os
+import sys
+import socket
+import argparse
+import threading
+import random
+import json
+import time
+
+import logging
+
+__author__ = "MapR"
+
+
+DEFAULT_PORT = 47001
+CHUNK = 64 * 1024
+PINGS = 20
+
+
+    # Receiver : accept up to "count" connections (or until timeout).
+    # Each connection is either answered ping-for-ping ("L") or
+    # drained of bulk data ("B"), after which the byte count and
+    # receive time are sent back as "<bytes> <seconds>\n".
+def serve(port, timeout=60, count=1) :
+    listener = socket.socket (socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt (socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind (('', port))
+    listener.listen (5)
+    listener.settimeout (timeout)
+
+    served = 0
+    while served < count :
+        try :
+            (conn, addr) = listener.accept()
+        except socket.timeout :
+            break
+        conn.settimeout (timeout)
+        try :
+            handleConnection (conn)
+        except socket.error :
+            pass
+        conn.close()
+        served += 1
+    listener.close()
+
+def handleConnection(conn) :
+    while True :
+        mode = conn.recv (1)
+        if mode == b'L' :
+            conn.sendall (b'L')
+        elif mode == b'B' :
+            received = 0
+            startTime = time.time()
+            while True :
+                data = conn.recv (CHUNK)
+                if not data :
+                    break
+                received += len(data)
+            elapsed = max (time.time() - startTime, 0.001)
+            conn.sendall (("%d %.6f\n" % (received, elapsed)).encode('ascii'))
+            return
+        else :
+            return
+
+
+    # Client : latency, then throughput, to a receiver.
+    # Returns { 'target', 'latency_ms', 'mbps' }
+def measure(host, port, seconds=5, timeout=10) :
+    conn = socket.create_connection ((host, port), timeout)
+    conn.setsockopt (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    rtts = []
+    for i in range (PINGS) :
+        startTime = time.time()
+        conn.sendall (b'L')
+        conn.recv (1)
+        rtts.append (time.time() - startTime)
+    rtts.sort()
+
+    conn.sendall (b'B')
+    payload = b'\0' * CHUNK
+    endTime = time.time() + seconds
+    while time.time() < endTime :
+        conn.sendall (payload)
+    conn.shutdown (socket.SHUT_WR)
+
+    reply = b''
+    while not reply.endswith (b'\n') :
+        data = conn.recv (64)
+        if not data :
+            break
+        reply += data
+    conn.close()
+
+    (received, elapsed) = reply.decode('ascii').split()
+    return { 'target' : host,
+        'latency_ms' : round (rtts[len(rtts) // 2] * 1000, 3),
+        'mbps' : round (int(received) * 8 / float(elapsed) / 1000000, 1) }
+
+
+    # Pair each host with its successor in a shuffled ring
+def samplePairs(hosts, maxPairs=None) :
+    ring = list(hosts)
+    random.shuffle (ring)
+    if len(ring) < 2 :
+        return []
+    pairs = [ (ring[i], ring[(i+1) % len(ring)]) for i in range(len(ring)) ]
+    if len(ring) == 2 :
+        pairs = pairs[:1]
+    if maxPairs != None :
+        pairs = pairs[:maxPairs]
+    return pairs
+
+
+    # Run the check across hosts (see module notes).  Returns
+    # (flagged hosts, list of per-pair results).
+    #
+    # MIExecutor is only imported here; the remote ends of the
+    # test run this module on its own (piped to "python -").
+    # deadline (see MIExecutor) bounds the remote commands; pairs
+    # not started before it runs out are reported without results.
+def checkNetwork(hosts, transport=None, minMbps=500, maxLatencyMs=5.0, seconds=5,
+        maxPairs=None, port=DEFAULT_PORT, python="python", deadline=None) :
+    from MIExecutor import MIExecutor, LocalTransport
+
+    logger = logging.getLogger()
+    if transport == None :
+        transport = LocalTransport()
+
+    pairs = samplePairs (hosts, maxPairs)
+    if len(pairs) == 0 :
+        return ([], [])
+
+        # Each receiver gets its own port, so that several can share
+        # a host (as in loopback tests).  Executor results are keyed
+        # by host, so each receiver and sender is its own run().
+    script = os.path.splitext (os.path.abspath (__file__))[0] + ".py"
+    rcvPort = {}
+    for i in range (len(pairs)) :
+        rcvPort[pairs[i]] = port + i
+    serveTimeout = seconds * 4 + 30
+
+    receiver = MIExecutor (transport, fanout=1, timeout=serveTimeout + 10, retries=0, deadline=deadline)
+    receivers = [ threading.Thread (target = receiver.run, 
+            args = ([ p[1] ], "--serve --timeout %d --port %d" % (serveTimeout, rcvPort[p]), script, python + " -"))
+        for p in pairs ]
+    for t in receivers :
+        t.daemon = True
+        t.start()
+    time.sleep (2)
+
+    senders = MIExecutor (transport, fanout=len(pairs), timeout=seconds + 30, retries=1, retryDelay=2, deadline=deadline)
+    results = []
+    lock = threading.Lock()
+    def runSender(pair) :
+        res = senders.run ([ pair[0] ], "--connect %s --port %d --seconds %d" % (pair[1], rcvPort[pair], seconds), script, python + " -")[0]
+        entry = { 'source' : pair[0], 'target' : pair[1], 'mbps' : None, 'latency_ms' : None }
+        for line in res['output'] :
+            if line.startswith ('{') :
+                m = json.loads (line)
+                entry['mbps'] = m['mbps']
+                entry['latency_ms'] = m['latency_ms']
+        with lock :
+            results.append (entry)
+
+    sendThreads = [ threading.Thread (target=runSender, args=(p,)) for p in pairs ]
+    for t in sendThreads :
+        t.daemon = True
+        t.start()
+    for t in sendThreads :
+        t.join()
+    for t in receivers :
+        t.join (serveTimeout + 10)
+
+    good = set()
+    bad = set()
+    for r in results :
+        ok = r['mbps'] != None  and  r['mbps'] >= minMbps  and  r['latency_ms'] <= maxLatencyMs
+        r['ok'] = ok
+        for h in ( r['source'], r['target'] ) :
+            if ok :
+                good.add (h)
+            else :
+                bad.add (h)
+
+    flagged = [ h for h in hosts if h in bad  and  h not in good ]
+    printResults (results, minMbps, maxLatencyMs)
+    for h in flagged :
+        logger.warn ("Host (%s) is below network threshold (%d Mbps, %.1f ms)", h, minMbps, maxLatencyMs)
+    return (flagged, results)
+
+def printResults(results, minMbps, maxLatencyMs) :
+    logger = logging.getLogger()
+    logger.info ("%-30s %-30s %10s %12s  %s", "SOURCE", "TARGET", "MBPS", "LATENCY_MS", "RESULT")
+    for r in sorted (results, key=lambda r: r['source']) :
+        logger.info ("%-30s %-30s %10s %12s  %s", r['source'], r['target'],
+            r['mbps'] != None and r['mbps'] or "-", r['latency_ms'] != None and r['latency_ms'] or "-",
+            r['ok'] and "ok" or "SLOW")
+
+
+def gatherArgs () :
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--serve", default=False, action="store_true",
+        help="Run a receiver")
+    parser.add_argument("--connect",
+        help="Run a client against the receiver on this host")
+    parser.add_argument("--loopback", type=int,
+        help="Run the full check locally across this many loopback addresses")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+        help="Receiver port")
+    parser.add_argument("--timeout", type=int, default=60,
+        help="Seconds a receiver waits for connections")
+    parser.add_argument("--seconds", type=int, default=5,
+        help="Seconds of bulk transfer per test")
+    parser.add_argument("--min-mbps", type=float, default=500,
+        help="Minimum acceptable throughput (loopback mode)")
+    parser.add_argument("--max-latency-ms", type=float, default=5.0,
+        help="Maximum acceptable latency (loopback mode)")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+    args = gatherArgs()
+
+    if args.serve == True :
+        serve (args.port, args.timeout)
+    elif args.connect != None :
+        sys.stdout.write (json.dumps (measure (args.connect, args.port, args.seconds)) + "\n")
+    elif args.loopback != None :
+        logging.basicConfig (level=logging.INFO, format='%(message)s', stream=sys.stdout)
+        hosts = [ "127.0.0.%d" % (i+1) for i in range(args.loopback) ]
+        (flagged, results) = checkNetwork (hosts, None, args.min_mbps, args.max_latency_ms,
+            args.seconds, port=args.port, python=sys.executable)
+        sys.exit (len(flagged) > 0 and 1 or 0)
@@ -0,0 +1,315 @@
+# MapR Deployment Duration Simulator (MISimulator)
+#
+# Predict how long a deployment will take, entirely offline.
+#
+# Usage :
+#   Calibrate a timing model from the event streams of past runs
+#   (deploy-mapr-cluster.py --event-stream ...), optionally with
+#   the snapshots of the clusters they deployed :
+#       MISimulator.py --calibrate run1.events run2.events --model timing.json
+#       MISimulator.py --calibrate run1.events --reference-layout run1.snapshot --model timing.json
+#
+#   then simulate a planned cluster :
+#       MISimulator.py --model timing.json --nodes 12 --concurrency 8
+#       MISimulator.py --model timing.json --layout cluster.snapshot
+#
+# Overview :
+#   The model follows the phases deploy-mapr-cluster.py runs
+#   (PREFLIGHT, INIT, NETWORK, CHECK, INSTALL, VERIFY), each with
+#   a duration distribution.   INSTALL is split into the per-host
+#   package installs, which run "concurrency" hosts at a time, and
+#   a fixed overhead (CHECKING/PROVISIONING hand-off, LICENSING,
+#   COMPLETED).   A host's install time scales with the number of
+#   services placed on it, relative to reference_services (the
+#   mean services per host of the calibration clusters, taken from
+#   --reference-layout).  Runs without a complete set of per-host
+#   install times only contribute their INSTALL phase duration,
+#   which is used as recorded when no host_install is known.
+#
+#   Each trial samples every distribution, schedules the hosts on
+#   the install slots (in host order, each starting as soon as a
+#   slot frees up) and adds up the phases.  The report gives
+#   p50/p95 of the total and, per phase, its median and p95 and
+#   how often it was the longest phase.
+#
+#   Model format (JSON; written by --calibrate or by hand) :
+#       { "phases" : { "INIT" : <dist>, "CHECK" : <dist>, "INSTALL" : <dist>, ... },
+#         "install_overhead" : <dist>,
+#         "host_install" : <dist>,
+#         "reference_services" : 9 }
+#   where <dist> is one of
+#       { "samples" : [ seconds, ... ] }      resampled as recorded
+#       { "median" : 300, "p95" : 600 }       log-normal
+#       { "fixed" : 60 }
+#
+#   Service layout (--layout) is a cluster snapshot written by
+#   deploy-mapr-cluster.py --export-snapshot; the number of
+#   services on each MAPRNODE<n> sets that host's install scale.
+#
+
+import sys
+import math
+import random
+import argparse
+import json
+
+import logging
+
+__author__ = "MapR"
+
+
+PHASES = [ 'PREFLIGHT', 'INIT', 'NETWORK', 'CHECK', 'INSTALL', 'VERIFY' ]
+NODE_PREFIX = "MAPRNODE"
+Z95 = 1.645
+
+
+def percentile(values, pct) :
+    values = sorted (values)
+    if len(values) == 0 :
+        return 0
+    idx = int (math.ceil (pct / 100.0 * len(values))) - 1
+    return values[max (0, min (idx, len(values) - 1))]
+
+
+    # Draw one duration (seconds) from a model distribution
+def sample(dist, rng) :
+    if dist == None :
+        return 0.0
+    if 'samples' in dist :
+        if len(dist['samples']) == 0 :
+            return 0.0
+        return float (rng.choice (dist['samples']))
+    if 'fixed' in dist :
+        return float (dist['fixed'])
+    median = float (dist['median'])
+    if median <= 0 :
+        return 0.0
+    sigma = 0.0
+    if dist.get('p95') != None  and  dist['p95'] > median :
+        sigma = math.log (dist['p95'] / median) / Z95
+    return rng.lognormvariate (math.log (median), sigma)
+
+
+    # Read one event stream (see MIDriver.MIEventStream) into
+    #   { 'phases' : { name : seconds }, 'hosts' : [ seconds ], 'overhead' : seconds }
+    # Per-host install time runs from the host's first INSTALLING
+    # state to INSTALLED.  If any host seen installing has no such
+    # sample (eg, it failed, or the stream was cut short), the run's
+    # host times are dropped and only its INSTALL phase is kept.
+def readEvents(lines) :
+    run = { 'phases' : {}, 'hosts' : [], 'overhead' : None }
+    phaseStart = {}
+    hostStart = {}
+    installing = set()
+    for line in lines :
+        line = line.strip()
+        if len(line) == 0 :
+            continue
+        try :
+            ev = json.loads (line)
+        except ValueError :
+            continue
+        kind = ev.get('event')
+        if kind == 'phase_start' :
+            phaseStart[ev['phase']] = ev['mono']
+        elif kind == 'phase_end'  and  ev['phase'] in phaseStart :
+            if ev.get('ok', True) :
+                run['phases'][ev['phase']] = ev['mono'] - phaseStart[ev['phase']]
+        elif kind == 'host_state' :
+            h = ev.get('host')
+            state = ev.get('state') or ""
+            if state.startswith ('INSTALL') :
+                installing.add (h)
+            if state == 'INSTALLING'  and  h not in hostStart :
+                hostStart[h] = ev['mono']
+            elif state == 'INSTALLED'  and  h in hostStart :
+                run['hosts'].append (ev['mono'] - hostStart.pop (h))
+
+    if len(run['hosts']) < len(installing) :
+        run['hosts'] = []
+    if 'INSTALL' in run['phases']  and  len(run['hosts']) > 0 :
+        run['overhead'] = max (0.0, run['phases']['INSTALL'] - max (run['hosts']))
+    return run
+
+
+    # Build a model from recorded runs (lists of readEvents results)
+    # and, if known, the service layouts of the clusters they
+    # deployed (see layoutFromSnapshot)
+def calibrate(runs, layouts=[]) :
+    model = { 'phases' : {}, 'install_overhead' : None, 'host_install' : None,
+        'reference_services' : None }
+    for name in PHASES :
+        samples = [ round (r['phases'][name], 1) for r in runs if name in r['phases'] ]
+        if len(samples) > 0 :
+            model['phases'][name] = { 'samples' : samples }
+
+    hosts = [ round (s, 1) for r in runs for s in r['hosts'] ]
+    if len(hosts) > 0 :
+        model['host_install'] = { 'samples' : hosts }
+    overheads = [ round (r['overhead'], 1) for r in runs if r['overhead'] != None ]
+    if len(overheads) > 0 :
+        model['install_overhead'] = { 'samples' : overheads }
+
+    counts = [ c for layout in layouts for c in layout ]
+    if len(counts) > 0 :
+        model['reference_services'] = round (sum (counts) / float (len(counts)), 2)
+    return model
+
+
+    # Services per host from a cluster snapshot, in MAPRNODE order
+def layoutFromSnapshot(snapshot) :
+    counts = [ 0 ] * snapshot.get('host_count', 0)
+    for svcId in snapshot.get('service_hosts', {}) :
+        for token in snapshot['service_hosts'][svcId] :
+            if token.startswith (NODE_PREFIX) :
+                idx = int (token[len(NODE_PREFIX):])
+                if idx < len(counts) :
+                    counts[idx] += 1
+    return counts
+
+
+class MISimulator:
+    def __init__(self, model, nodes, concurrency=None, layout=None, seed=None) :
+        self.model = model
+        self.nodes = nodes
+        self.concurrency = concurrency
+        if self.concurrency == None  or  self.concurrency <= 0 :
+            self.concurrency = nodes
+        self.rng = random.Random (seed)
+
+            # Per-host install scale.  Hosts beyond the layout get
+            # the most common services count in it.  Without a
+            # reference_services in the model, the layout's own 
+            # mean is the reference.
+        self.scale = [ 1.0 ] * nodes
+        ref = model.get('reference_services')
+        if layout != None  and  len(layout) > 0 :
+            if ref == None :
+                ref = sum (layout) / float (len(layout))
+            common = max (set(layout), key=layout.count)
+            counts = layout[:nodes] + [ common ] * max (0, nodes - len(layout))
+            self.scale = [ ref > 0 and c / float(ref) or 1.0 for c in counts ]
+
+        # Install makespan : hosts start in order as slots free up.
+        # Models with no per-host times use the recorded INSTALL
+        # phase instead.
+    def installTime(self) :
+        if self.model.get('host_install') == None :
+            return sample (self.model['phases'].get('INSTALL'), self.rng)
+        slots = [ 0.0 ] * min (self.concurrency, self.nodes)
+        for i in range (self.nodes) :
+            j = slots.index (min (slots))
+            slots[j] += sample (self.model.get('host_install'), self.rng) * self.scale[i]
+        return max (slots + [ 0.0 ])
+
+        # One simulated deployment : { phase : seconds }
+    def trial(self) :
+        times = {}
+        for name in PHASES :
+            if name == 'INSTALL' :
+                times[name] = self.installTime() + sample (self.model.get('install_overhead'), self.rng)
+            else :
+                times[name] = sample (self.model['phases'].get(name), self.rng)
+        return times
+
+    def run(self, trials=1000) :
+        results = [ self.trial() for i in range (trials) ]
+        totals = [ sum (t.values()) for t in results ]
+        phases = {}
+        for name in PHASES :
+            values = [ t[name] for t in results ]
+            longest = len ([ t for t in results if max (t, key=t.get) == name ])
+            phases[name] = { 'p50' : percentile (values, 50), 'p95' : percentile (values, 95),
+                'longest' : longest / float (trials) }
+        bottleneck = max (PHASES, key=lambda p: phases[p]['p50'])
+        return { 'trials' : trials, 'nodes' : self.nodes, 'concurrency' : self.concurrency,
+            'p50' : percentile (totals, 50), 'p95' : percentile (totals, 95),
+            'phases' : phases, 'bottleneck' : bottleneck }
+
+def printReport(report) :
+    logger = logging.getLogger()
+    logger.info ("Simulated %d deployments of %d nodes (install concurrency %d)",
+        report['trials'], report['nodes'], report['concurrency'])
+    logger.info ("")
+    logger.info ("%-12s %10s %10s %10s", "PHASE", "P50", "P95", "LONGEST")
+    for name in PHASES :
+        p = report['phases'][name]
+        logger.info ("%-12s %9.0fs %9.0fs %9.0f%%", name, p['p50'], p['p95'], p['longest'] * 100)
+    logger.info ("%-12s %9.0fs %9.0fs", "TOTAL", report['p50'], report['p95'])
+    logger.info ("")
+    logger.info ("Total: p50 %.1f min, p95 %.1f min", report['p50'] / 60, report['p95'] / 60)
+    bn = report['bottleneck']
+    logger.info ("Bottleneck: %s (%.0f%% of the median total)", bn,
+        report['p50'] > 0 and report['phases'][bn]['p50'] / report['p50'] * 100 or 0)
+
+
+def gatherArgs () :
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--calibrate", nargs='+',
+        help="Event stream files from past runs to build the model from")
+    parser.add_argument("--reference-layout", nargs='+',
+        help="Snapshots of the clusters deployed by the --calibrate runs, to set reference_services")
+    parser.add_argument("--model", required=True,
+        help="Timing model (JSON); written when calibrating, read otherwise")
+    parser.add_argument("--nodes", type=int,
+        help="Cluster size (default : the --layout host count)")
+    parser.add_argument("--layout",
+        help="Cluster snapshot (see deploy-mapr-cluster.py --export-snapshot) giving the service layout")
+    parser.add_argument("--concurrency", type=int,
+        help="Hosts installed at once (default : all)")
+    parser.add_argument("--trials", type=int, default=2000,
+        help="Number of simulated deployments")
+    parser.add_argument("--seed", type=int,
+        help="Random seed (for repeatable results)")
+    parser.add_argument("--json", default=False, action="store_true",
+        help="Print the report as JSON")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__' :
+    logging.basicConfig (level=logging.INFO, format='%(message)s', stream=sys.stdout)
+    logger = logging.getLogger()
+    args = gatherArgs()
+
+    if args.calibrate != None :
+        runs = []
+        for fname in args.calibrate :
+            with open (fname, "r") as ef :
+                runs.append (readEvents (ef))
+        layouts = []
+        for fname in args.reference_layout or [] :
+            with open (fname, "r") as lf :
+                layouts.append (layoutFromSnapshot (json.load (lf)))
+        model = calibrate (runs, layouts)
+        with open (args.model, "w") as mf :
+            json.dump (model, mf, indent=4, sort_keys=True)
+        logger.info ("Model from %d runs (%d host installs) written to %s",
+            len(runs), sum ([ len(r['hosts']) for r in runs ]), args.model)
+        if model['reference_services'] == None :
+            logger.warn ("No --reference-layout given; reference_services will be taken from the simulated layout")
+        if args.nodes == None  and  args.layout == None :
+            sys.exit (0)
+
+    with open (args.model, "r") as mf :
+        model = json.load (mf)
+    model.setdefault ('phases', {})
+
+    layout = None
+    if args.layout != None :
+        with open (args.layout, "r") as lf :
+            layout = layoutFromSnapshot (json.load (lf))
+    nodes = args.nodes
+    if nodes == None :
+        nodes = layout != None and len(layout) or 0
+    if nodes <= 0 :
+        logger.error ("Cluster size unknown; give --nodes or --layout")
+        sys.exit (1)
+
+    report = MISimulator (model, nodes, args.concurrency, layout, args.seed).run (args.trials)
+    if args.json == True :
+        sys.stdout.write (json.dumps (report, indent=4, sort_keys=True) + "\n")
+    else :
+        printReport (report)
+    sys.exit (0)
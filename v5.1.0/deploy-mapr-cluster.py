@@ -11,6 +11,9 @@
 #   1 : Failure : Failed initialization phase (INIT) 
 #   2 : Failure : Cluster validation failed (CHECK phase)
 #   3 : Failure : INSTALLATION failed
+#   4 : Failure : Required services not responding after installation
+#                 (only with --verify-services)
+#   5 : Failure : Deadline (--deadline) exceeded
 #
 # Important details about defaults
 #   There are multiple levels of attribute defaults in this
@@ -35,9 +38,9 @@
 #       cluster = 'MyCluster'
 #       ssh-user = 'ec2-user'
 #
-# TBD
-#   Add logic to support "--eco-verison <product>=latest" ... for latest 
-#   supported version.
+#   "--eco-version <product>=latest" selects the latest version
+#   of that product available from the installer that is compatible
+#   with the requested MapR version.
 
 
 import os
@@ -52,11 +55,63 @@ import ssl
 import logging
 import logging.config 
 
-from MIDriver import MIDriver
+from MIDriver import MIDriver, MIDeadline, MIDeadlineExceeded, MIEventStream, azureVmSize
+from MIExecutor import MIExecutor, SshTransport
+from MINetCheck import checkNetwork
+from MILogAnalyzer import MILogAnalyzer
 
 __author__ = "MapR"
  
 
+# Per-host/per-task timing summary of the installer process log
+def analyzeProcessLog (driver) :
+    analyzer = MILogAnalyzer()
+    analyzer.consume (driver.iter_process_log())
+    analyzer.printReport()
+
+
+# Run one phase of the deployment against the deadline, 
+# aborting with the phase report if the budget runs out.
+def runPhase (deadline, name, func, *args, **kwargs) :
+    deadline.startPhase (name)
+    events.emit ('phase_start', phase = name, remaining = deadline.remaining())
+    try :
+        rc = func (*args, **kwargs)
+    except MIDeadlineExceeded as e :
+        deadline.endPhase (False)
+        events.emit ('phase_end', phase = name, ok = False, reason = "deadline exceeded")
+        logger.error ("Deadline exceeded during %s (%s); aborting", name, e)
+        deadline.report()
+        finish (5)
+    deadline.endPhase (rc)
+    events.emit ('phase_end', phase = name, ok = (rc != False))
+    return rc
+
+# Wrap a step that stops early rather than raising when the 
+# budget runs out (eg, MIExecutor runs), so that runPhase still
+# aborts the deployment for it
+def withDeadline (func) :
+    def run (*args, **kwargs) :
+        rc = func (*args, **kwargs)
+        deadline.check (getattr (func, '__name__', "step"))
+        return rc
+    return run
+
+# Emit the final summary event and exit
+def finish (rc) :
+    summary = { 'rc' : rc, 'elapsed' : round (time.time() - deadline.start, 1),
+        'phases' : [ { 'phase' : p['name'], 'seconds' : round ((p['end'] or time.time()) - p['start'], 1), 
+            'ok' : p['result'] != False } for p in deadline.phases ] }
+    drv = globals().get ('driver')
+    if drv != None :
+        summary['state'] = drv.current_state
+        summary['failed_hosts'] = drv.failed_hosts
+        summary['quarantined_hosts'] = drv.quarantined_hosts
+    events.emit ('summary', **summary)
+    events.close()
+    exit (rc)
+
+
 # We'll use this struct to initialize logging below.
 # We accept command line options to set log level and output file.
 #
@@ -184,16 +239,74 @@ def gatherArgs () :
         help="Registered username for retrieving demo licenses from  stage.mapr.com/license")
     parser.add_argument("--stage-password", 
         help="Password for stage user")
+    parser.add_argument("--license-cache-dir", default="/var/tmp/mapr-licenses",
+        help="Directory caching trial licenses between runs")
+    parser.add_argument("--license-offline", default=False, action="store_true",
+        help="Use only licenses already in --license-cache-dir (never contact the stage server)")
     parser.add_argument("--disks",
         help="Comma-separate list of disks for MapR-FS on cluster nodes")
     parser.add_argument("--disks-file",
-        help="File containing disks for MapR-FS (one disk per line)")
+        help="File containing disks for MapR-FS (one disk per line; see qualify-disks.py)")
     parser.add_argument("--hosts",
         help="Comma-separate list of hosts on which to deploy MapR")
     parser.add_argument("--hosts-file",
         help="File containing hosts (one host per line)")
+    parser.add_argument("--stall-window", type=int, default=300,
+        help="Seconds without progress before a host is reported as stalled")
+    parser.add_argument("--wait-per-host", type=int, default=60,
+        help="Seconds added to the install deadline for each cluster host")
+    parser.add_argument("--max-failed-hosts", type=int, default=0,
+        help="Number of failed hosts that may be retried separately and quarantined instead of failing the install")
+    parser.add_argument("--host-retries", type=int, default=2,
+        help="Retry attempts for the failed subset of hosts")
+    parser.add_argument("--compress-requests", default=False, action="store_true",
+        help="gzip large request bodies sent to the installer")
+    parser.add_argument("--package-mirror",
+        help="URL of a local/in-VNet package repository (laid out as package.mapr.com/releases) to install from")
+    parser.add_argument("--package-mirror-dir",
+        help="Local directory served as --package-mirror (required for --prefetch-packages)")
+    parser.add_argument("--prefetch-packages", default=False, action="store_true",
+        help="Copy packages missing from the mirror into --package-mirror-dir before INIT")
+    parser.add_argument("--package-upstream", default="http://package.mapr.com/releases",
+        help="Repository to prefetch missing packages from")
+    parser.add_argument("--request-concurrency", type=int, default=8,
+        help="Maximum concurrent requests to the installer (the limit adapts to installer latency up to this)")
+    parser.add_argument("--request-latency-target", type=float, default=2.0,
+        help="Installer response time (seconds) above which request concurrency is reduced")
+    parser.add_argument("--from-snapshot",
+        help="Configure the cluster from a snapshot file (see --export-snapshot) instead of the service options")
+    parser.add_argument("--export-snapshot",
+        help="Write a snapshot of the installed cluster configuration to this file")
+    parser.add_argument("--preflight-command",
+        help="Command run on every host (in parallel) before configuring the installer; hosts where it fails are excluded")
+    parser.add_argument("--preflight-timeout", type=int, default=300,
+        help="Seconds allowed for the preflight command on each host")
+    parser.add_argument("--verify-services", default=False, action="store_true",
+        help="Probe service ports on all hosts after installation")
+    parser.add_argument("--verify-http", default=False, action="store_true",
+        help="Include an HTTP status check in --verify-services")
+    parser.add_argument("--verify-grace", type=int, default=300,
+        help="Seconds --verify-services keeps re-probing endpoints that are not up yet")
+    parser.add_argument("--required-services", default="webserver",
+        help="Comma-separated services that must respond for --verify-services to succeed")
+    parser.add_argument("--vm-size",
+        help="Azure VM size of the cluster nodes (eg Standard_DS13); selects storage pool and service memory tuning (default : this node's size from the Azure instance metadata)")
+    parser.add_argument("--network-check", default=False, action="store_true",
+        help="Measure bandwidth/latency between sampled host pairs before validating the cluster")
+    parser.add_argument("--network-min-mbps", type=float, default=500,
+        help="Hosts below this throughput are flagged by --network-check")
+    parser.add_argument("--network-max-latency-ms", type=float, default=5.0,
+        help="Hosts above this latency are flagged by --network-check")
+    parser.add_argument("--network-pairs", type=int,
+        help="Maximum number of host pairs tested by --network-check (default: one per host)")
+    parser.add_argument("--event-stream",
+        help="Write JSON-lines progress events to fd:N or unix:PATH")
+    parser.add_argument("--deadline", type=int,
+        help="Seconds allowed for the whole deployment (eg, 2700 for 45 minutes); every phase gets only what is left")
+    parser.add_argument("--analyze-log", default=False, action="store_true",
+        help="Summarize per-host/per-task timings from the installer process log after the install")
     parser.add_argument("--eco-version", nargs='*', action='append',
-        help="Desired versions of esystem comments; format is <pkg>=<ver> (use multiple times for multiple components)")
+        help="Desired versions of esystem comments; format is <pkg>=<ver> or <pkg>=latest (use multiple times for multiple components)")
 
     args = parser.parse_args()
     return (args)
@@ -304,6 +417,10 @@ else :
 # Next, so some minimal error checking and variable expansion
 checkedArgs = checkArgs (myArgs)
 
+    # The time budget starts now (and covers the preflight checks)
+deadline = MIDeadline (checkedArgs.deadline)
+events = MIEventStream (checkedArgs.event_stream)
+
     # Convert Namespace to a Dictionary (to get rid of our
     # "null" values" and allow iteration).  For now, this is just debug
     #   Mask out ssh_key and account passwords
@@ -328,6 +445,24 @@ logger.debug ("\n"+json.dumps(argDict,indent=4,sort_keys=True))
 #     exit (0)
 
 
+# Optional preflight check of the hosts (eg, confirming that
+# prepare-node.sh has completed).  Failed hosts are excluded.
+if checkedArgs.preflight_command != None :
+    executor = MIExecutor (
+        SshTransport (checkedArgs.ssh_user, checkedArgs.ssh_keyfile, checkedArgs.ssh_password), 
+        timeout = checkedArgs.preflight_timeout, deadline = deadline)
+    results = runPhase (deadline, "PREFLIGHT", withDeadline (executor.run), checkedArgs.hosts, checkedArgs.preflight_command)
+    executor.printResults (results)
+
+    badHosts = [ r['host'] for r in results if not r['ok'] ]
+    if len(badHosts) > 0 :
+        logger.warn ( "Excluding hosts that failed preflight check: "+','.join(badHosts) )
+        checkedArgs.hosts = [ h for h in checkedArgs.hosts if h not in badHosts ]
+    if len(checkedArgs.hosts) == 0 :
+        logger.error ( "No hosts passed preflight check; aborting" )
+        finish (1)
+
+
 # TBD Change design to throw exception if the installer is not found
 driver = MIDriver (checkedArgs.installer_url, checkedArgs.mapr_user, checkedArgs.mapr_password)
 
@@ -345,9 +480,25 @@ driver.setPortalCredentials (
 driver.setStageCredentials (
     getattr(checkedArgs,'stage_user', None), 
     getattr(checkedArgs,'stage_password', None)) 
+driver.setLicenseCache (checkedArgs.license_cache_dir, checkedArgs.license_offline)
 driver.setHosts (checkedArgs.hosts)
 driver.setDisks (checkedArgs.disks)
+if checkedArgs.vm_size == None :
+    checkedArgs.vm_size = azureVmSize()
+    if checkedArgs.vm_size != None :
+        logger.info ("VM size %s (from instance metadata)", checkedArgs.vm_size)
+driver.setVmSize (checkedArgs.vm_size)
 driver.setSilentRunning (checkedArgs.quiet)
+driver.setStallWindow (checkedArgs.stall_window)
+driver.setWaitPerHost (checkedArgs.wait_per_host)
+driver.setVerifyGrace (checkedArgs.verify_grace)
+driver.setFailedHostPolicy (checkedArgs.max_failed_hosts, checkedArgs.host_retries)
+driver.setCompressRequests (checkedArgs.compress_requests)
+driver.setPackageMirror (checkedArgs.package_mirror, checkedArgs.package_mirror_dir,
+    checkedArgs.prefetch_packages, checkedArgs.package_upstream)
+driver.setDeadline (deadline)
+driver.setEventStream (events)
+driver.setRequestConcurrency (checkedArgs.request_concurrency, checkedArgs.request_latency_target)
 
     # There is certainly a better way to handle this,
     # but at least this works.
@@ -391,45 +542,80 @@ for svc in [ 'pig', 'drill', 'hue', 'oozie' ] :
         driver.addEcoServices (svc, ver)
 
 
-operationOK = driver.initializeClusterConfig()
+if checkedArgs.from_snapshot != None :
+    operationOK = runPhase (deadline, "INIT", driver.applySnapshot, checkedArgs.from_snapshot)
+else :
+    operationOK = runPhase (deadline, "INIT", driver.initializeClusterConfig)
 if operationOK == True :
     if checkedArgs.yes == False :
         cont = query_yes_no ("Configuration uploaded; continue with CHECKING ?", "yes")
         if cont != True :
-            exit (0)
+            finish (0)
 else :
-    driver.printProcessStatus()
+    driver.bestEffort (driver.printProcessStatus)
     logger.error ( "Failed to initialized installer services; aborting" )
-    exit (1)
+    finish (1)
+
+if checkedArgs.network_check == True :
+    (slowHosts, netResults) = runPhase (deadline, "NETWORK", withDeadline (checkNetwork), checkedArgs.hosts,
+        SshTransport (checkedArgs.ssh_user, checkedArgs.ssh_keyfile, checkedArgs.ssh_password), 
+        checkedArgs.network_min_mbps, checkedArgs.network_max_latency_ms,
+        maxPairs = checkedArgs.network_pairs, deadline = deadline)
+    if len(slowHosts) > 0 :
+        logger.warn ( "Hosts below network threshold: "+','.join(slowHosts) )
+        if checkedArgs.yes == False :
+            cont = query_yes_no ("Some hosts have degraded networking; continue with CHECKING ?", "no")
+            if cont != True :
+                finish (0)
 
-operationOK = driver.checkClusterConfig()
+operationOK = runPhase (deadline, "CHECK", driver.checkClusterConfig)
 if operationOK == True :
     if checkedArgs.yes == False :
         cont = query_yes_no ("Configuration validated; continue with INSTALL ?", "yes")
         if cont != True :
-            exit (0)
+            finish (0)
 else :
     state=driver.current_state
     if state[-4:] == "WARN"  and  checkedArgs.ignore_warnings == True :
         if checkedArgs.yes == False :
             cont = query_yes_no ("Configuration validated (with WARNINGS); continue with INSTALL ?", "yes")
             if cont != True :
-                exit (0)
+                finish (0)
     else :
-        driver.printProcessStatus()
+        driver.bestEffort (driver.printProcessStatus)
         logger.error ( "Failed to validate configuration; aborting" )
-        exit (2)
+        finish (2)
 
-operationOK = driver.doInstall()
+operationOK = runPhase (deadline, "INSTALL", driver.doInstall)
+if checkedArgs.analyze_log == True :
+    driver.bestEffort (analyzeProcessLog, driver)
 if operationOK == False :
-    driver.printProcessStatus()
+    driver.bestEffort (driver.printProcessStatus)
+    if len(driver.failed_hosts) > 0 :
+        logger.error ( "Failed hosts: "+','.join(driver.failed_hosts) )
     logger.error ( "Failed to complete cluster installation; aborting" )
-    exit (3)
+    finish (3)
+
+if len(driver.quarantined_hosts) > 0 :
+    logger.warn ( "Hosts quarantined after repeated install failures: "+','.join(driver.quarantined_hosts) )
 
 if checkedArgs.quiet == False :
     logger.info ( "" )
     driver.printSuccessUrl()
-    driver.printMCS()
+    driver.bestEffort (driver.printMCS)
+
+if checkedArgs.verify_services == True :
+    operationOK = runPhase (deadline, "VERIFY", driver.verifyServices, checkedArgs.required_services.split(","), checkedArgs.verify_http)
+    if operationOK == False :
+        logger.error ( "Required services are not responding" )
+        finish (4)
+
+if checkedArgs.export_snapshot != None :
+    runPhase (deadline, "EXPORT", driver.exportSnapshot, checkedArgs.export_snapshot)
 
+driver.logWireStats()
+driver.logSchedulerStats()
+if checkedArgs.deadline != None :
+    deadline.report()
 logger.info('deploy-mapr-cluster.py completed')
-exit (0)
+finish (0)
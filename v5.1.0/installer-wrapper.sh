@@ -233,6 +233,7 @@ while [ $attempt -le $MAX_TRIES ] ; do
 		--cluster $MAPR_CLUSTER \
 		--hosts-file /tmp/maprhosts \
 		--disks-file /tmp/MapR.disks ${ECO_HIVE:-} ${ECO_PIG:-} \
+		--verify-services \
 		--stage-user msazure \
 		--stage-password MyCl0ud.ms \
 		--mapr-password $MAPR_PASSWD \
@@ -242,7 +243,9 @@ while [ $attempt -le $MAX_TRIES ] ; do
 	dmcRet=$?
 	echo "Cluster Installation attempt $attempt returned status $dmcRet"
 
-		# Exit on success or INSTALL failure; retry on INIT or CHECK failure
+		# Exit on success, INSTALL failure (3), services not yet
+		# responding after a good install (4) or deadline (5); 
+		# retry on INIT or CHECK failure
 	if [ $dmcRet -eq 0  -o  $dmcRet -ge 3 ] ; then
 		attempt=$[MAX_TRIES + 1]
 	else
@@ -251,8 +254,13 @@ while [ $attempt -le $MAX_TRIES ] ; do
 	fi
 done
 
-# Post-install operations on successful deployment
-if [ $dmcRet -eq 0  ] ; then
+# Post-install operations on successful deployment.  Status 4 means 
+# the install completed but some services (eg, MCS) had not come up
+# within the verification grace period; the cluster is still ours
+# to finish setting up.
+[ $dmcRet -eq 4 ] && \
+	echo "Cluster installed, but required services were not responding yet"
+if [ $dmcRet -eq 0  -o  $dmcRet -eq 4 ] ; then
 		# enable SUDO_USER to access the cluster
 	[ ${SUDO_USER} != "root" ] && \
 		su $MAPR_USER -c "maprcli acl edit -type cluster -user $SUDO_USER:login"
@@ -266,6 +274,6 @@ fi
 # For PublicKey-configured clusters, disable password authentication
 #	NOTE: This means that the users will have to take the private
 #	key from the Admin User to run the installer again.
-[ $dmcRet -eq 0 ] && sh $BINDIR/gen-lock-cluster.sh $SUDO_USER $AUTH_METHOD
+[ $dmcRet -eq 0  -o  $dmcRet -eq 4 ] && sh $BINDIR/gen-lock-cluster.sh $SUDO_USER $AUTH_METHOD
 
 exit $dmcRet
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+#   NOTE: Requires Python 2.7 (no additional packages)
+#
+# Usage
+#   qualify-disks.py [--write] --disks-file /tmp/MapR.disks \
+#       --output /tmp/MapR.disks.qualified --report /tmp/MapR.disks.json
+#
+#   deploy-mapr-cluster.py --disks-file /tmp/MapR.disks.qualified ...
+#
+# Overview
+#   prepare-disks.sh picks candidate disks with mount/swap/LVM
+#   heuristics, which says nothing about how fast they are.  This
+#   tool measures each candidate device (or file) with direct I/O :
+#       sequential read  (1 MB requests)
+#       random read      (4 KB requests)
+#       sequential write (1 MB requests; only with --write)
+#       random write     (4 KB requests; only with --write)
+#   ranks the devices by sequential read throughput, and excludes
+#   any device that falls below --threshold times the median of
+#   any measured metric (or below --min-seq-mbps).  The qualified
+#   devices are written one per line to --output and the full
+#   measurements to --report as JSON.
+#
+#   WARNING : --write overwrites data on the devices.  Only use it
+#   on disks that are about to be given to MapR-FS.
+#
+#   For testing, the candidates can be regular files (or loopback
+#   devices backed by files).  If the filesystem does not support
+#   O_DIRECT (eg, tmpfs), buffered I/O is used and the report
+#   records "direct" : false.
+#
+# Exit Codes :
+#   0 : At least one disk qualified
+#   1 : No disks qualified (or no candidates)
+#
+
+import os
+import sys
+import io
+import mmap
+import random
+import argparse
+import json
+import time
+
+import logging
+
+__author__ = "MapR"
+
+
+SEQ_BLOCK = 1024 * 1024
+RAND_BLOCK = 4096
+
+
+def gatherArgs () :
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument("--disks",
+        help="Comma-separate list of candidate disks (or files)")
+    parser.add_argument("--disks-file",
+        help="File containing candidate disks (one disk per line)")
+    parser.add_argument("--output",
+        help="File to receive the qualified disks (one disk per line); default is stdout")
+    parser.add_argument("--report",
+        help="File to receive the JSON measurement report")
+    parser.add_argument("--write", default=False, action="store_true",
+        help="Also measure write throughput (DESTROYS DATA on the disks)")
+    parser.add_argument("--duration", type=float, default=5.0,
+        help="Seconds spent on each test of each disk")
+    parser.add_argument("--size", type=int, default=1024,
+        help="Maximum MB of each disk to exercise")
+    parser.add_argument("--threshold", type=float, default=0.5,
+        help="Exclude disks below this fraction of the median of any metric")
+    parser.add_argument("--min-seq-mbps", type=float, default=0,
+        help="Exclude disks with sequential read below this rate (MB/s)")
+
+    return parser.parse_args()
+
+
+def readCandidates (args) :
+    disks = []
+    if args.disks != None :
+        disks = [ d for d in args.disks.split(",") if len(d) > 0 ]
+    elif args.disks_file != None  and  os.path.isfile(args.disks_file) :
+        with open (args.disks_file, "r") as df :
+            for line in df :
+                fields = line.split()
+                if len(fields) > 0 :
+                    disks.append (fields[0])
+    return disks
+
+
+    # Open for direct I/O when possible.   Returns (fd, direct)
+def openDisk (disk, writable) :
+    flags = writable and os.O_RDWR or os.O_RDONLY
+    if hasattr (os, 'O_DIRECT') :
+        try :
+            return (os.open (disk, flags | os.O_DIRECT), True)
+        except OSError :
+            pass
+    return (os.open (disk, flags), False)
+
+
+    # Run one test for up to "duration" seconds over the first
+    # "span" bytes of the disk.  Returns MB/s.
+def runTest (fd, span, duration, block, sequential, write) :
+    buf = mmap.mmap (-1, block)             # page-aligned for O_DIRECT
+    if write :
+        buf.write (os.urandom (block))
+    reader = io.FileIO (fd, closefd=False)
+
+    nblocks = max (1, span // block)
+    done = 0
+    nextBlock = 0
+    startTime = time.time()
+    while time.time() - startTime < duration :
+        if sequential :
+            blk = nextBlock
+            nextBlock = (nextBlock + 1) % nblocks
+        else :
+            blk = random.randrange (nblocks)
+        os.lseek (fd, blk * block, os.SEEK_SET)
+        if write :
+            n = os.write (fd, buf)
+        else :
+            n = reader.readinto (buf)
+        if n <= 0 :
+            nextBlock = 0
+            continue
+        done += n
+
+    if write :
+        os.fsync (fd)
+    elapsed = max (time.time() - startTime, 0.001)
+    buf.close()
+    return round (done / elapsed / (1024 * 1024), 1)
+
+
+def measureDisk (disk, args) :
+    result = { 'disk' : disk, 'direct' : False, 'error' : None }
+    try :
+        (fd, direct) = openDisk (disk, args.write)
+    except OSError as e :
+        result['error'] = str(e)
+        return result
+
+    result['direct'] = direct
+    try :
+        span = min (os.lseek (fd, 0, os.SEEK_END), args.size * 1024 * 1024)
+        if span < SEQ_BLOCK :
+            result['error'] = "too small (%d bytes)" % span
+            return result
+
+        result['seq_read'] = runTest (fd, span, args.duration, SEQ_BLOCK, True, False)
+        result['rand_read'] = runTest (fd, span, args.duration, RAND_BLOCK, False, False)
+        if args.write :
+            result['seq_write'] = runTest (fd, span, args.duration, SEQ_BLOCK, True, True)
+            result['rand_write'] = runTest (fd, span, args.duration, RAND_BLOCK, False, True)
+    except (OSError, IOError) as e :
+        result['error'] = str(e)
+    finally :
+        os.close (fd)
+    return result
+
+
+def median (values) :
+    values = sorted (values)
+    mid = len(values) // 2
+    if len(values) % 2 == 1 :
+        return values[mid]
+    return (values[mid-1] + values[mid]) / 2.0
+
+
+    # Mark each result qualified (or not, with the reasons) and
+    # return the results ranked best first
+def qualify (results, threshold, minSeq) :
+    measured = [ r for r in results if r['error'] == None ]
+    medians = {}
+    for metric in [ 'seq_read', 'rand_read', 'seq_write', 'rand_write' ] :
+        values = [ r[metric] for r in measured if metric in r ]
+        if len(values) > 0 :
+            medians[metric] = median (values)
+
+    for r in results :
+        r['reasons'] = []
+        if r['error'] != None :
+            r['reasons'].append (r['error'])
+        else :
+            for metric in medians :
+                if r[metric] < threshold * medians[metric] :
+                    r['reasons'].append ("%s %.1f MB/s below %.0f%% of median %.1f" %
+                        (metric, r[metric], threshold * 100, medians[metric]))
+            if r['seq_read'] < minSeq :
+                r['reasons'].append ("seq_read %.1f MB/s below minimum %.1f" % (r['seq_read'], minSeq))
+        r['qualified'] = ( len(r['reasons']) == 0 )
+
+    ranked = sorted (results, key=lambda r: r.get('seq_read', -1), reverse=True)
+    return (ranked, medians)
+
+
+if __name__ == '__main__' :
+    logging.basicConfig (level=logging.INFO, format='%(message)s', stream=sys.stderr)
+    logger = logging.getLogger()
+    args = gatherArgs()
+
+    disks = readCandidates (args)
+    if len(disks) == 0 :
+        logger.error ("No candidate disks specified")
+        sys.exit (1)
+
+    results = []
+    for d in disks :
+        logger.info ("Measuring %s ...", d)
+        results.append (measureDisk (d, args))
+
+    (ranked, medians) = qualify (results, args.threshold, args.min_seq_mbps)
+
+    logger.info ("%-20s %-6s %10s %10s %10s %10s  %s", "DISK", "DIRECT", "SEQ_RD", "RAND_RD", "SEQ_WR", "RAND_WR", "RESULT")
+    for r in ranked :
+        logger.info ("%-20s %-6s %10s %10s %10s %10s  %s", r['disk'], r['direct'] and "yes" or "no",
+            r.get('seq_read', '-'), r.get('rand_read', '-'), r.get('seq_write', '-'), r.get('rand_write', '-'),
+            r['qualified'] and "ok" or "EXCLUDED: " + "; ".join(r['reasons']))
+
+    qualified = [ r['disk'] for r in ranked if r['qualified'] ]
+    if args.output != None :
+        with open (args.output, "w") as of :
+            for d in qualified :
+                of.write (d + "\n")
+    else :
+        for d in qualified :
+            sys.stdout.write (d + "\n")
+
+    if args.report != None :
+        report = { 'created' : time.strftime ("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            'threshold' : args.threshold, 'min_seq_mbps' : args.min_seq_mbps,
+            'medians' : medians, 'disks' : ranked, 'qualified' : qualified }
+        with open (args.report, "w") as rf :
+            json.dump (report, rf, indent=4, sort_keys=True)
+
+    if len(qualified) == 0 :
+        sys.exit (1)
+    sys.exit (0)